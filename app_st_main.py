@@ -1,52 +1,43 @@
 # app_st_main.py
 
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-from sqlalchemy import func
-from utils.boot_st import get_db
+from utils.db_stats_st import get_db_version, get_schema_stats
+from utils.insights_st import get_insights
 from PIL import Image
 
 st.set_page_config(page_title="Chinook Database Dashboard", page_icon="🎵", layout="wide", initial_sidebar_state="auto", menu_items=None)
 
-def get_table_row_count(engine, table):
-    with engine.connect() as connection:
-        result = connection.execute(func.count().select().select_from(table))
-        return result.scalar()
-
 def main():
     st.title("Chinook Database Dashboard 🎵💽")
 
     st.info("This dashboard provides an overview of the Chinook database structure and some key insights from the data.", icon="ℹ️")
 
-    # Get database connection and metadata
-    engine, metadata = get_db()
+    # All table statistics come from one cached query, refreshed only when the database changes
+    schema_stats = get_schema_stats(get_db_version())
 
     # Database Statistics
     st.header("Database Overview")
     col1, col2, col3 = st.columns(3)
     
-    total_tables = len(metadata.tables)
+    total_tables = len(schema_stats)
     col1.metric("Total Tables", total_tables)
     
-    total_rows = sum(get_table_row_count(engine, table) for table in metadata.tables.values())
+    total_rows = int(schema_stats["row_count"].sum())
     col2.metric("Total Rows", total_rows)
     
-    total_columns = sum(len(table.columns) for table in metadata.tables.values())
+    total_columns = int(schema_stats["column_count"].sum())
     col3.metric("Total Columns", total_columns)
 
     # Table Information
     st.header("Table Information")
-    table_info = []
-    for table_name, table in metadata.tables.items():
-        row_count = get_table_row_count(engine, table)
-        table_info.append({
-            "Table Name": table_name,
-            "Columns": len(table.columns),
-            "Rows": row_count
-        })
-    
-    df_table_info = pd.DataFrame(table_info)
+    df_table_info = schema_stats.rename(columns={
+        "table_name": "Table Name",
+        "column_count": "Columns",
+        "row_count": "Rows",
+        "foreign_key_count": "Foreign Keys",
+        "index_count": "Indexes"
+    })[["Table Name", "Columns", "Rows", "Foreign Keys", "Indexes"]]
     
     # Bar chart for table sizes
     fig_table_sizes = px.bar(df_table_info, x="Table Name", y="Rows", 
@@ -68,18 +59,12 @@ def main():
 
     col1, col2 = st.columns(2)
 
+    # Rollups are materialized on disk and only recomputed when their source tables change
+    insights = get_insights(get_db_version())
+
     with col1:
         # Top 10 Artists by Track Count
-        query_top_artists = """
-        SELECT Artist.Name, COUNT(Track.TrackId) as TrackCount
-        FROM Artist
-        JOIN Album ON Artist.ArtistId = Album.ArtistId
-        JOIN Track ON Album.AlbumId = Track.AlbumId
-        GROUP BY Artist.ArtistId
-        ORDER BY TrackCount DESC
-        LIMIT 10
-        """
-        df_top_artists = pd.read_sql(query_top_artists, engine)
+        df_top_artists = insights["top_artists"]
         fig_top_artists = px.bar(df_top_artists, x="Name", y="TrackCount", 
                                  title="Top 10 Artists by Track Count",
                                  labels={"Name": "Artist", "TrackCount": "Number of Tracks"},
@@ -88,27 +73,13 @@ def main():
 
     with col2:
         # Tracks by Genre
-        query_genre_distribution = """
-        SELECT Genre.Name, COUNT(Track.TrackId) as TrackCount
-        FROM Genre
-        JOIN Track ON Genre.GenreId = Track.GenreId
-        GROUP BY Genre.GenreId
-        ORDER BY TrackCount DESC
-        LIMIT 10
-        """
-        df_genre_distribution = pd.read_sql(query_genre_distribution, engine)
+        df_genre_distribution = insights["genre_distribution"]
         fig_genre_distribution = px.pie(df_genre_distribution, values="TrackCount", names="Name", 
                                         title="Distribution of Tracks by Top 10 Genre")
         st.plotly_chart(fig_genre_distribution, use_container_width=True)
 
     # Sales Over Time
-    query_sales_over_time = """
-    SELECT strftime('%Y-%m', InvoiceDate) as Month, SUM(Total) as TotalSales
-    FROM Invoice
-    GROUP BY Month
-    ORDER BY Month
-    """
-    df_sales_over_time = pd.read_sql(query_sales_over_time, engine)
+    df_sales_over_time = insights["sales_over_time"]
     fig_sales_over_time = px.line(df_sales_over_time, x="Month", y="TotalSales", 
                                   title="Sales Over Time",
                                   labels={"Month": "Month", "TotalSales": "Total Sales ($)"},
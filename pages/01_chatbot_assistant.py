@@ -2,9 +2,10 @@
 import streamlit as st
 import pandas as pd
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
-from utils.boot_st import init_page_chatbot, initialize_llms
-from utils.settings_st import models
-from utils.helpers_st import get_user_input, display_chat_history
+from utils.boot_st import init_page_chatbot, initialize_llms, warm_up_model
+from utils.settings_st import models, chat_auto_execute_sql, chat_preamble_length
+from utils.helpers_st import get_user_input, get_compare_input, display_chat_history
+from utils.response_cache_st import get_response_cache
 
 # Streamlit App
 st.title("Chatbot assistant")
@@ -14,15 +15,21 @@ if "boot_chatbot" not in st.session_state.keys():
 llms = initialize_llms()
 
 # Dropdown for model selection in the sidebar
+available_models = [(provider, model) for provider, model in models if (provider, model) in llms]
 with st.sidebar:
     st.header("Model Selection")
-    available_models = [(provider, model) for provider, model in models if (provider, model) in llms]
-    
-    # Initialize default values in session state if not present
-    if "selected_provider" not in st.session_state:
-        st.session_state.selected_provider = available_models[0][0]
-    if "selected_model" not in st.session_state:
-        st.session_state.selected_model = available_models[0][1]
+    for provider, reason in llms.unavailable_providers().items():
+        st.caption(f"{provider} models are not available: {reason}")
+
+if not available_models:
+    st.error("No LLM model is available: start the Ollama server or add an API key to .streamlit/secrets.toml, then reload the page.")
+    st.stop()
+
+with st.sidebar:
+    # Initialize default values in session state if not present,
+    # or if the selected model's provider is no longer available
+    if (st.session_state.get("selected_provider"), st.session_state.get("selected_model")) not in available_models:
+        st.session_state.selected_provider, st.session_state.selected_model = available_models[0]
     
     selected_provider, selected_model = st.selectbox(
         "Choose an LLM model for the next question:",
@@ -34,19 +41,47 @@ with st.sidebar:
     # Update session state
     st.session_state.selected_provider = selected_provider
     st.session_state.selected_model = selected_model
+    warm_up_model(selected_provider, selected_model)
 
     # Print selected model information
     st.write(f"Current Provider: {st.session_state.selected_provider}")
     st.write(f"Current Model: {st.session_state.selected_model}")
 
+    # SQL in the answers is executed and its results saved to the query history
+    st.toggle("Run generated SQL", value=chat_auto_execute_sql, key="auto_execute_sql")
+
+    # Compare mode: the same question is sent to several models in parallel
+    compare_mode = st.toggle("Compare models")
+    if compare_mode:
+        compare_models = st.multiselect(
+            "Models to compare:",
+            available_models,
+            default=available_models[:2],
+            format_func=lambda x: f"{x[0]} - {x[1]}",
+        )
+
 # Print current length of messages list
-st.sidebar.write(f"Current number of messages: {len(st.session_state.messages_chatbot)-11}")
+st.sidebar.write(f"Current number of messages: {len(st.session_state.messages_chatbot) - chat_preamble_length}")
 
 display_chat_history()
 
-get_user_input()
+if compare_mode:
+    if compare_models:
+        get_compare_input(compare_models)
+    else:
+        st.info("Select at least one model to compare.")
+else:
+    get_user_input()
 
 # Add a button to clear the chat history
 if st.sidebar.button("Clear Chat History"):
-    st.session_state.messages_chatbot = st.session_state.messages_chatbot[0:11]  # Keep the first 11 messages
+    # Keep the system prompt and few-shot examples
+    st.session_state.messages_chatbot = st.session_state.messages_chatbot[:chat_preamble_length]
+    st.rerun()
+
+# Cached answers are shared by all sessions; clearing forces fresh answers from the models
+response_cache = get_response_cache()
+st.sidebar.caption(f"Cached answers: {len(response_cache)}")
+if st.sidebar.button("Clear Response Cache"):
+    response_cache.clear()
     st.rerun()
@@ -1,22 +1,25 @@
 # pages/02_sql_assistant.py
 import streamlit as st
-from sqlalchemy import text
 import pandas as pd
 from utils.boot_st import init_page_database, get_db
+from utils.query_st import execute_cached_sql_query, describe_result, get_result_cache
+from utils.query_history_st import init_query_history
+from utils.history_view_st import render_query_history, render_entry_result, open_history_entry
+from utils.query_plan_st import render_query_inspector, record_timing
 import json
 import pyperclip
 import logging
 
-# Function to execute SQL query
-def execute_sql_query(query, engine):
-    try:
-        with engine.connect() as connection:
-            result = connection.execute(text(query))
-            columns = result.keys()
-            data = result.fetchall()
-        return pd.DataFrame(data, columns=columns)
-    except Exception as e:
-        return str(e)
+# Function to execute SQL query, showing the first chunk of rows as soon as it arrives
+# Results are shared between sessions through the process-wide result cache
+def run_query(query, engine):
+    placeholder = st.empty()
+    response = execute_cached_sql_query(query, engine, on_first_chunk=placeholder.dataframe)
+    placeholder.empty()
+    # every execution that reached SQLite is timed, for the Explain mode
+    if isinstance(response, pd.DataFrame) and not response.attrs.get("cache_hit"):
+        record_timing(query, response.attrs["elapsed_time"])
+    return response
 
 # Function to sample top 5 rows and copy to clipboard as JSON
 def sample_and_copy_to_clipboard(df):
@@ -35,12 +38,21 @@ def sample_and_copy_to_clipboard(df):
 st.title("Database Assistant")
 if "boot_db" not in st.session_state.keys():
     init_page_database()
+init_query_history()
 
 # Option to clear query history
 if st.sidebar.button("Clear Query History"):
-    st.session_state.query_history = {}
+    st.session_state.query_history.clear()
     st.rerun()
 
+# Result cache statistics
+cache_stats = get_result_cache().stats()
+st.sidebar.caption(f"Result cache: {cache_stats['entries']} results, {cache_stats['bytes'] / (1024 * 1024):.1f} MB, "
+                   f"{cache_stats['hits']} hits / {cache_stats['misses']} misses")
+
+# Explain mode: query plan, timings and index suggestions for the last query
+explain_mode = st.sidebar.toggle("Explain mode")
+
 # Database connection
 engine, metadata_db = get_db()
 
@@ -48,41 +60,44 @@ engine, metadata_db = get_db()
 query = st.chat_input("Enter your SQL query:")
 if query:
     # Execute query and get response
-    response = execute_sql_query(query, engine)
+    response = run_query(query, engine)
     
     # Save query and result to session state
     if isinstance(response, pd.DataFrame):
         st.session_state.query_history[query] = response
         st.success("Query executed successfully!")
-        st.dataframe(response)
     else:
         st.session_state.query_history[query] = f"Error: {response}"
         st.error(f"Error executing query: {response}")
+    st.session_state.explain_query = query
+    # the result is shown by its entry in the history, so paging through its rows survives reruns
+    open_history_entry("db", query)
 
-# Display query history
-st.header("SQL Query History")
-total_queries = len(st.session_state.query_history)
-query_items = list(st.session_state.query_history.items())
+if explain_mode and st.session_state.get("explain_query"):
+    render_query_inspector(st.session_state.explain_query)
 
-for i, (past_query, result) in enumerate(reversed(query_items), 1):
-    query_number = total_queries - i + 1  # Calculate the correct query number
-    with st.expander(f"Query {query_number} of {total_queries}: {past_query[:50]}..."):
-        st.code(past_query, language="sql")
-        if isinstance(result, pd.DataFrame):
-            st.dataframe(result)
-            if st.button(f"Copy Top 5 rows from Query {query_number}"):
-                if sample_and_copy_to_clipboard(result):
-                    st.success("Top 5 rows copied to clipboard in JSON format!")
-                else:
-                    st.warning("No data to copy.")
-        else:
-            st.error(result)
-        if st.button(f"Re-execute Query {query_number}"):
-            response = execute_sql_query(past_query, engine)
-            if isinstance(response, pd.DataFrame):
-                st.session_state.query_history[past_query] = response
-                st.success("Query re-executed successfully!")
-                st.dataframe(response)
+# Display query history, only the opened query shows its result
+def render_history_entry(query_number, past_query, entry):
+    st.code(past_query, language="sql")
+    result = render_entry_result(past_query, entry, key=f"db_{query_number}")
+    if result is not None:
+        st.caption(describe_result(result))
+        if st.button(f"Copy Top 5 rows from Query {query_number}"):
+            if sample_and_copy_to_clipboard(result):
+                st.success("Top 5 rows copied to clipboard in JSON format!")
             else:
-                st.session_state.query_history[past_query] = f"Error: {response}"
-                st.error(f"Error executing query: {response}")
+                st.warning("No data to copy.")
+    if explain_mode and st.button(f"Explain Query {query_number}"):
+        st.session_state.explain_query = past_query
+        st.rerun()
+    if st.button(f"Re-execute Query {query_number}"):
+        response = run_query(past_query, engine)
+        if isinstance(response, pd.DataFrame):
+            st.session_state.query_history[past_query] = response
+        else:
+            st.session_state.query_history[past_query] = f"Error: {response}"
+        # the entry shows the new result, or its error, from the next run on
+        st.rerun()
+
+st.header("SQL Query History")
+render_query_history("db", render_history_entry)
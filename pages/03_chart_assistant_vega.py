@@ -1,56 +1,78 @@
 # pages/03_chart_assistant_vega.py
 import streamlit as st
 import pandas as pd
+from utils.history_view_st import render_query_history, render_entry_result
+from utils.query_st import load_full_result, numeric_columns as get_numeric_columns
+from utils.figure_cache_st import cached_chart_spec
+from utils.chart_query_st import chart_aggregates, run_chart_query, describe_chart_query
+from utils.chart_data_st import reduce_chart_data, bin_count_column
 import altair as alt
 
-def create_chart(df, chart_type, x_column, y_column):
+def create_chart(df, chart_type, x_column, y_column, reduce=True):
+    # only the reduced data is inlined in the chart spec; series aggregated by SQLite are already small
+    data, note = reduce_chart_data(df, chart_type, x_column, y_column) if reduce else (df, None)
     if chart_type == "bar":
-        chart = alt.Chart(df).mark_bar().encode(
+        chart = alt.Chart(data).mark_bar().encode(
             x=alt.X(x_column, title=x_column),
             y=alt.Y(y_column, title=y_column)
         ).interactive()
     elif chart_type == "line":
-        chart = alt.Chart(df).mark_line().encode(
+        chart = alt.Chart(data).mark_line().encode(
             x=alt.X(x_column, title=x_column),
             y=alt.Y(y_column, title=y_column)
         ).interactive()
     else:  # circle (scatter plot)
-        chart = alt.Chart(df).mark_circle().encode(
-            x=alt.X(x_column, title=x_column),
-            y=alt.Y(y_column, title=y_column)
-        ).interactive()
+        encoding = {"x": alt.X(x_column, title=x_column), "y": alt.Y(y_column, title=y_column)}
+        if bin_count_column in data.columns:
+            encoding["size"] = alt.Size(bin_count_column, title="Rows")
+        chart = alt.Chart(data).mark_circle().encode(**encoding).interactive()
 
-    return chart
+    return chart, note
+
+def create_chart_spec(df, chart_type, x_column, y_column, reduce=True):
+    chart, note = create_chart(df, chart_type, x_column, y_column, reduce)
+    # the reduced data stays under Altair's row limit, so the spec can inline it
+    return chart.to_dict(), note
 
 def main():
     st.title("Chart Assistant Vega-Altair")
 
-    # Initialize query_history if it doesn't exist
-    if 'query_history' not in st.session_state:
-        st.session_state.query_history = {}
-
-    # Display query history in reverse order
+    # Display query history in reverse order, only the opened query shows its result
     st.header("SQL Query History")
-    total_queries = len(st.session_state.query_history)
-    for i, (query, result) in enumerate(reversed(list(st.session_state.query_history.items())), 1):
-        query_number = total_queries - i + 1  # Calculate the original query number
-        with st.expander(f"Query {query_number} of {total_queries}: {query[:50]}..."):
-            st.code(query, language='sql')
-            if isinstance(result, pd.DataFrame):
-                st.dataframe(result)
-                
-                # User selects chart type and columns
-                chart_type = st.selectbox(f"Select chart type for Query {query_number}", ["bar", "line", "circle"])
-                columns = result.columns.tolist()
-                x_column = st.selectbox(f"Select X-axis column for Query {query_number}", columns)
-                numeric_columns = result.select_dtypes(include=['int64', 'float64']).columns.tolist()
-                y_column = st.selectbox(f"Select Y-axis column for Query {query_number}", numeric_columns)
-                
-                if st.button(f"Generate Chart for Query {query_number}"):
-                    chart = create_chart(result, chart_type, x_column, y_column)
-                    st.altair_chart(chart, use_container_width=True)
+    render_query_history("chart", render_history_entry)
+
+def render_history_entry(query_number, query, entry):
+    st.code(query, language='sql')
+    result = render_entry_result(query, entry, key=f"chart_{query_number}")
+    if result is not None:
+
+        # User selects chart type and columns
+        chart_type = st.selectbox(f"Select chart type for Query {query_number}", ["bar", "line", "circle"])
+        columns = result.columns.tolist()
+        x_column = st.selectbox(f"Select X-axis column for Query {query_number}", columns)
+        numeric_columns = get_numeric_columns(result)  # computed once, when the query ran
+        y_column = st.selectbox(f"Select Y-axis column for Query {query_number}", numeric_columns)
+
+        aggregate = st.selectbox(f"Aggregate Y by X for Query {query_number}", list(chart_aggregates))
+
+        if st.button(f"Generate Chart for Query {query_number}"):
+            if aggregate == "none":
+                # the figure is only built the first time this chart of this result is asked for
+                spec, note = cached_chart_spec(result, chart_type, x_column, y_column, "vega",
+                                               lambda: create_chart_spec(load_full_result(result), chart_type, x_column, y_column))
             else:
-                st.error(f"Error: {result}")
+                # SQLite aggregates the stored query, only the series is fetched
+                series = run_chart_query(query, x_column, y_column, aggregate, chart_type)
+                if not isinstance(series, pd.DataFrame):
+                    st.error(f"Error executing the chart query: {series}")
+                    return
+                spec, note = cached_chart_spec(series, chart_type, x_column, y_column, "vega",
+                                               lambda: create_chart_spec(series, chart_type, x_column, y_column, reduce=False), aggregate)
+                # SQLite applied the binning and the row limit: the series is drawn as is
+                note = describe_chart_query(series)
+            st.vega_lite_chart(spec, use_container_width=True)
+            if note:
+                st.caption(note)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
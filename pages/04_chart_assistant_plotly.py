@@ -1,48 +1,73 @@
 # pages/04_chart_assistant_plotly.py
 import streamlit as st
 import pandas as pd
+from utils.history_view_st import render_query_history, render_entry_result
+from utils.query_st import load_full_result, numeric_columns as get_numeric_columns
+from utils.figure_cache_st import cached_chart_spec
+from utils.chart_query_st import chart_aggregates, run_chart_query, describe_chart_query
+from utils.chart_data_st import reduce_chart_data, use_webgl, bin_count_column
 import plotly.express as px
 
-def create_chart(df, chart_type, x_column, y_column):
+def create_chart(df, chart_type, x_column, y_column, reduce=True):
+    # only the reduced data is sent to the browser, large point counts are drawn with WebGL;
+    # series aggregated by SQLite are already small
+    data, note = reduce_chart_data(df, chart_type, x_column, y_column) if reduce else (df, None)
+    render_mode = "webgl" if use_webgl(data) else "auto"
     if chart_type == "bar":
-        fig = px.bar(df, x=x_column, y=y_column, title=f"{y_column} by {x_column}")
+        fig = px.bar(data, x=x_column, y=y_column, title=f"{y_column} by {x_column}")
     elif chart_type == "line":
-        fig = px.line(df, x=x_column, y=y_column, title=f"{y_column} over {x_column}")
+        fig = px.line(data, x=x_column, y=y_column, title=f"{y_column} over {x_column}", render_mode=render_mode)
     else:  # scatter
-        fig = px.scatter(df, x=x_column, y=y_column, title=f"{y_column} vs {x_column}")
+        size = bin_count_column if bin_count_column in data.columns else None
+        fig = px.scatter(data, x=x_column, y=y_column, size=size, title=f"{y_column} vs {x_column}", render_mode=render_mode)
     
     fig.update_layout(xaxis_title=x_column, yaxis_title=y_column)
-    return fig
+    return fig, note
+
+def create_chart_spec(df, chart_type, x_column, y_column, reduce=True):
+    fig, note = create_chart(df, chart_type, x_column, y_column, reduce)
+    # the serialized figure is shared by all sessions, so none of them can change another's chart
+    return fig.to_plotly_json(), note
 
 def main():
     st.title("Chart Assistant with Plotly")
 
-    # Initialize query_history if it doesn't exist
-    if 'query_history' not in st.session_state:
-        st.session_state.query_history = {}
-
-    # Display query history in reverse order
+    # Display query history in reverse order, only the opened query shows its result
     st.header("SQL Query History")
-    total_queries = len(st.session_state.query_history)
-    for i, (query, result) in enumerate(reversed(list(st.session_state.query_history.items())), 1):
-        query_number = total_queries - i + 1  # Calculate the original query number
-        with st.expander(f"Query {query_number} of {total_queries}: {query[:50]}..."):
-            st.code(query, language='sql')
-            if isinstance(result, pd.DataFrame):
-                st.dataframe(result)
-                
-                # User selects chart type and columns
-                chart_type = st.selectbox(f"Select chart type for Query {query_number}", ["bar", "line", "scatter"])
-                columns = result.columns.tolist()
-                x_column = st.selectbox(f"Select X-axis column for Query {query_number}", columns)
-                numeric_columns = result.select_dtypes(include=['int64', 'float64']).columns.tolist()
-                y_column = st.selectbox(f"Select Y-axis column for Query {query_number}", numeric_columns)
-                
-                if st.button(f"Generate Chart for Query {query_number}"):
-                    fig = create_chart(result, chart_type, x_column, y_column)
-                    st.plotly_chart(fig, use_container_width=True)
+    render_query_history("chart", render_history_entry)
+
+def render_history_entry(query_number, query, entry):
+    st.code(query, language='sql')
+    result = render_entry_result(query, entry, key=f"chart_{query_number}")
+    if result is not None:
+
+        # User selects chart type and columns
+        chart_type = st.selectbox(f"Select chart type for Query {query_number}", ["bar", "line", "scatter"])
+        columns = result.columns.tolist()
+        x_column = st.selectbox(f"Select X-axis column for Query {query_number}", columns)
+        numeric_columns = get_numeric_columns(result)  # computed once, when the query ran
+        y_column = st.selectbox(f"Select Y-axis column for Query {query_number}", numeric_columns)
+
+        aggregate = st.selectbox(f"Aggregate Y by X for Query {query_number}", list(chart_aggregates))
+
+        if st.button(f"Generate Chart for Query {query_number}"):
+            if aggregate == "none":
+                # the figure is only built the first time this chart of this result is asked for
+                spec, note = cached_chart_spec(result, chart_type, x_column, y_column, "plotly",
+                                               lambda: create_chart_spec(load_full_result(result), chart_type, x_column, y_column))
             else:
-                st.error(f"Error: {result}")
+                # SQLite aggregates the stored query, only the series is fetched
+                series = run_chart_query(query, x_column, y_column, aggregate, chart_type)
+                if not isinstance(series, pd.DataFrame):
+                    st.error(f"Error executing the chart query: {series}")
+                    return
+                spec, note = cached_chart_spec(series, chart_type, x_column, y_column, "plotly",
+                                               lambda: create_chart_spec(series, chart_type, x_column, y_column, reduce=False), aggregate)
+                # SQLite applied the binning and the row limit: the series is drawn as is
+                note = describe_chart_query(series)
+            st.plotly_chart(spec, use_container_width=True)
+            if note:
+                st.caption(note)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
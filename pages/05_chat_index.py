@@ -2,39 +2,32 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from collections import Counter
 import datetime
+from utils.analytics_st import (get_metadata_log_reader, get_chat_rollups, merge_aggregates, rows_in_range,
+                                categorize_prompts)
 
-# Load and preprocess data
-@st.cache_data(ttl=60)  # Cache data for 60 seconds
+# Load data, only rows appended to the log since the last run are parsed
 def load_data():
-    df = pd.read_csv("log/metadata.csv")
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    return df
+    return get_metadata_log_reader().load()
 
 def preprocess_prompts(df):
-    def categorize_prompt(prompt):
-        if isinstance(prompt, str):
-            if prompt.strip().startswith('SELECT'):
-                return 'SQL QUERY'
-            elif prompt.strip().startswith('['):
-                return 'JSON OBJECT'
-        return prompt
-
     new_df = df.copy()
-    new_df['processed_prompt'] = new_df['user_prompt'].apply(categorize_prompt)
+    new_df['processed_prompt'] = categorize_prompts(new_df['user_prompt'])
     return new_df
 
 def main():
     st.title("Chat History Dashboard")
     
-    # Click the refresh button to check for updates in the .csv file
+    # Click the refresh button to read the .csv file again from the start
     if st.sidebar.button('Refresh Data'):
-        # This will clear all cached data
-        st.cache_data.clear()
+        # This only resets the log reader, other pages keep their cached data
+        get_metadata_log_reader().reset()
     
     # load the .csv file
     df = load_data()
+    if df.empty:
+        st.info("No chat history has been logged yet.")
+        return
 
     # Sidebar for time range selection
     st.sidebar.header("Time Range Selection")
@@ -51,35 +44,39 @@ def main():
         st.error("Error: End date must be after start date.")
         return
     
-    # Filter dataframe based on selected date range
-    mask = (df['timestamp'].dt.date >= start_date) & (df['timestamp'].dt.date <= end_date)
-    filtered_df = df.loc[mask]
+    # Statistics come from time-bucketed rollups, only the rows logged since the last run are aggregated
+    reader = get_metadata_log_reader()
+    rollups = get_chat_rollups()
+    rollups.update(df, reader.generation)
+    range_start = pd.Timestamp(start_date)
+    range_end = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+    range_stats = rollups.query(range_start, range_end)
+    overall = merge_aggregates(range_stats.values())
+
+    # Rows of the selected range, for the recent queries
+    filtered_df = rows_in_range(df, range_start, range_end)
 
     # Overall Statistics
     st.header("Selected range")
     # Display selected date range
     st.write(f"Analyzing data from {start_date} to {end_date}")
-    st.metric("Data Points included in Range: ", len(filtered_df))
+    st.metric("Data Points included in Range: ", overall.count)
     
     st.header("Overall Statistics")
-    total_queries = len(filtered_df)
-    avg_response_time = filtered_df['elapsed_time'].mean()
+    total_queries = overall.count
+    avg_response_time = overall.mean
 
-    col1, col2 = st.columns(2)
+    col1, col2, col3, col4 = st.columns(4)
     col1.metric("Total Queries", total_queries)
     col2.metric("Avg Response Time", f"{avg_response_time:.2f} seconds")
-
-    processed_df = preprocess_prompts(filtered_df)
+    col3.metric("Median Response Time", f"{overall.sketch.quantile(0.5):.2f} seconds")
+    col4.metric("95th Percentile", f"{overall.sketch.quantile(0.95):.2f} seconds")
 
     # Most Frequent User Queries
     st.header("Most Frequent User Queries")
-    # Filter out 'SQL QUERY' and 'JSON OBJECT' from word count, and ignore words with 3 letters or less
-    word_counts = Counter(
-    word.lower()
-    for prompt in processed_df[processed_df['processed_prompt'].isin(['SQL QUERY', 'JSON OBJECT']) == False]['processed_prompt']
-    for word in prompt.split()
-    if len(word) > 3
-    )
+    # Words of 'SQL QUERY' and 'JSON OBJECT' prompts, stop words and words with 3 letters or less are not counted.
+    # Prompts are tokenized once into the rollups, the range only merges their per-bucket counts.
+    word_counts = rollups.query_terms(range_start, range_end)
     top_queries = word_counts.most_common(10)
     top_queries_df = pd.DataFrame(top_queries, columns=['Word', 'Frequency'])
     fig_top_queries = px.bar(top_queries_df, x='Word', y='Frequency', title='Top 10 Words in User Queries (>3 letters)')
@@ -87,34 +84,46 @@ def main():
 
     # Query Type Distribution
     st.header("Query Type Distribution")
-    query_type_dist = processed_df['processed_prompt'].apply(lambda x: 'SQL QUERY' if x == 'SQL QUERY' else ('JSON OBJECT' if x == 'JSON OBJECT' else 'Other')).value_counts()
+    query_type_dist = pd.Series(rollups.query_prompt_types(range_start, range_end), dtype=int).sort_values(ascending=False)
     fig_query_type_dist = px.pie(values=query_type_dist.values, names=query_type_dist.index, 
                                  title='Distribution of Query Types')
     st.plotly_chart(fig_query_type_dist)
 
     # Query Distribution by Provider
     st.header("Query Distribution by Provider")
-    provider_dist = filtered_df['provider'].value_counts()
+    provider_dist = pd.Series({provider: 0 for provider, _ in range_stats}, dtype=int)
+    for (provider, _), aggregate in range_stats.items():
+        provider_dist[provider] += aggregate.count
+    provider_dist = provider_dist.sort_values(ascending=False)
     fig_provider_dist = px.pie(values=provider_dist.values, names=provider_dist.index, 
                                title='Query Distribution by Provider')
     st.plotly_chart(fig_provider_dist)
 
     # Model Performance
     st.header("Model Performance")
-    model_performance = filtered_df.groupby('model')['elapsed_time'].mean().sort_values(ascending=False)
+    model_aggregates = {}
+    for (_, model), aggregate in range_stats.items():
+        model_aggregates.setdefault(model, []).append(aggregate)
+    model_performance = pd.Series({model: merge_aggregates(aggregates).mean
+                                   for model, aggregates in model_aggregates.items()},
+                                  name='elapsed_time', dtype=float).sort_values(ascending=False)
     fig_model_perf = px.bar(model_performance, x=model_performance.index, y='elapsed_time', 
                             title='Average Response Time by Model')
     st.plotly_chart(fig_model_perf)
     
-    # Response Time Distribution
+    # Response Time Distribution, from the merged latency sketch
     st.header("Response Time Distribution")
-    fig_resp_time_dist = px.histogram(filtered_df, x='elapsed_time', nbins=20, 
-                                      title='Distribution of Response Times')
+    edges, counts = overall.sketch.histogram(bins=20)
+    fig_resp_time_dist = px.bar(x=(edges[:-1] + edges[1:]) / 2, y=counts,
+                                labels={'x': 'elapsed_time', 'y': 'count'},
+                                title='Distribution of Response Times')
+    fig_resp_time_dist.update_layout(bargap=0)
     st.plotly_chart(fig_resp_time_dist)
 
     # Recent Activity
     st.header("10 Recent Queries")
-    st.dataframe(processed_df[['timestamp', 'provider', 'model', 'processed_prompt', 'elapsed_time']].tail(10).sort_values('timestamp', ascending=False))
+    processed_df = preprocess_prompts(filtered_df.tail(10))
+    st.dataframe(processed_df[['timestamp', 'provider', 'model', 'processed_prompt', 'elapsed_time']].sort_values('timestamp', ascending=False))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,299 @@
+# utils/analytics_st.py
+# incremental loading and pre-aggregation of the chat metadata log for the Chat History Dashboard
+
+import io
+import os
+import math
+import threading
+from collections import Counter
+import streamlit as st
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from utils.settings_st import metadata_csv_path, rollup_bucket_freq, latency_sketch_accuracy
+from utils.telemetry_st import log_lock
+
+# low-cardinality text columns stored as categoricals
+categorical_columns = ['provider', 'model']
+
+
+def _typed(df):
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
+    for column in categorical_columns:
+        df[column] = df[column].astype('category')
+    return df
+
+
+class MetadataLogReader:
+    """Typed in-memory copy of the metadata CSV log, refreshed incrementally.
+
+    The reader remembers the byte offset it has parsed up to, so each refresh only parses
+    rows appended since. The file is read again from the start if it was replaced,
+    truncated or its header changed (new columns).
+    """
+
+    def __init__(self, path=metadata_csv_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.generation = 0  # bumped on every full reload
+        self.reset()
+
+    def reset(self):
+        """Forget everything read so far, the next load() parses the whole file."""
+        self.df = None
+        self.generation += 1
+        self._offset = 0
+        self._header = None
+        self._inode = None
+
+    def _needs_full_reload(self, f, stat):
+        if self.df is None or stat.st_ino != self._inode or stat.st_size < self._offset:
+            return True
+        return f.read(len(self._header)) != self._header
+
+    def load(self):
+        """The whole log as a DataFrame, after parsing any newly appended rows."""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return pd.DataFrame()
+            with log_lock(self.path, exclusive=False), open(self.path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if self._needs_full_reload(f, stat):
+                    self.reset()
+                    f.seek(0)
+                    data = f.read()
+                    self._header = data.split(b"\n", 1)[0] + b"\n"
+                    self.df = _typed(pd.read_csv(io.BytesIO(data)))
+                    self._offset = len(data)
+                    self._inode = stat.st_ino
+                elif stat.st_size > self._offset:
+                    f.seek(self._offset)
+                    data = f.read()
+                    if data.endswith(b"\n"):  # otherwise a writer is mid-batch: pick it up next time
+                        new_rows = _typed(pd.read_csv(io.BytesIO(data), header=None, names=self.df.columns))
+                        self._append(new_rows)
+                        self._offset += len(data)
+            return self.df
+
+    def _append(self, new_rows):
+        combined = pd.concat([self.df, new_rows], ignore_index=True)
+        for column in categorical_columns:
+            combined[column] = union_categoricals([self.df[column], new_rows[column]], ignore_order=True)
+        self.df = combined
+
+# one reader per server, shared by every session of the dashboard
+@st.cache_resource(show_spinner=False)
+def get_metadata_log_reader():
+    return MetadataLogReader()
+
+
+# words left out of the most frequent words in user prompts
+stop_words = frozenset("""
+    about above after again also among another because been before being below between both cannot
+    could does doing down during each from further have having here into just more most much only other
+    over same should some such than that their them then there these they this those through under until
+    very want what when where which while will with would your yours please show give list find tell
+""".split())
+
+# words of at least 4 letters, the same threshold the dashboard always used
+_term_pattern = r"[a-z][a-z0-9_'-]{3,}"
+
+def categorize_prompts(prompts):
+    """'SQL QUERY' or 'JSON OBJECT' for pasted queries and data, the prompt itself otherwise."""
+    stripped = prompts.astype('string').str.lstrip()
+    categories = np.select(
+        [stripped.str.startswith('SELECT').fillna(False).to_numpy(bool),
+         stripped.str.startswith('[').fillna(False).to_numpy(bool)],
+        ['SQL QUERY', 'JSON OBJECT'],
+        default=prompts.to_numpy(object),
+    )
+    return pd.Series(categories, index=prompts.index, dtype=object)
+
+def prompt_types(categories):
+    """'SQL QUERY', 'JSON OBJECT' or 'Other' for the output of categorize_prompts."""
+    return categories.where(categories.isin(['SQL QUERY', 'JSON OBJECT']), 'Other')
+
+def extract_terms(prompts):
+    """One row per word of the prompts (lower case, stop words removed), indexed like prompts."""
+    terms = prompts.astype('string').str.lower().str.findall(_term_pattern).explode().dropna()
+    return terms[~terms.isin(stop_words)]
+
+
+class LatencySketch:
+    """Mergeable quantile sketch with a bounded relative error (DDSketch-style log buckets).
+
+    A value v > 0 is counted in bucket ceil(log(v) / log(gamma)); every value in a bucket is
+    within latency_sketch_accuracy of the bucket's representative value.
+    """
+
+    __slots__ = ("counts", "zero_count")
+    gamma = (1 + latency_sketch_accuracy) / (1 - latency_sketch_accuracy)
+    log_gamma = math.log(gamma)
+
+    def __init__(self):
+        self.counts = {}
+        self.zero_count = 0
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        indexes, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(int), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.zero_count += other.zero_count
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        total = self.zero_count + sum(self.counts.values())
+        if total == 0:
+            return float("nan")
+        rank = round(q * (total - 1))
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if rank < seen:
+                return self._value(index)
+        return self._value(max(self.counts))
+
+    def histogram(self, bins=20):
+        """(bin edges, counts) of the sketched values, merged down to about bins bins."""
+        if not self.counts:
+            return np.array([0.0, 0.0]), np.array([self.zero_count])
+        values = np.array([self._value(index) for index in sorted(self.counts)])
+        weights = np.array([self.counts[index] for index in sorted(self.counts)])
+        counts, edges = np.histogram(values, bins=bins, range=(0.0, values.max()), weights=weights)
+        counts[0] += self.zero_count
+        return edges, counts
+
+
+class Aggregate:
+    """Count, sum, min, max and latency sketch of the response times of one bucket."""
+
+    __slots__ = ("count", "total", "minimum", "maximum", "sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.sketch = LatencySketch()
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        self.count += len(values)
+        if len(values):
+            self.total += float(np.nansum(values))
+            self.minimum = min(self.minimum, float(np.nanmin(values)))
+            self.maximum = max(self.maximum, float(np.nanmax(values)))
+        self.sketch.add_many(values)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.sketch.merge(other.sketch)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else float("nan")
+
+
+class ChatRollups:
+    """Time-bucketed aggregates of the chat log by provider and model.
+
+    Only rows added to the log since the last update are aggregated. A date range is
+    answered by merging its buckets, so the cost grows with the number of days (or hours)
+    in the range rather than with the number of logged requests.
+    """
+
+    def __init__(self, freq=rollup_bucket_freq):
+        self.freq = freq
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, generation):
+        self.buckets = {}       # bucket start -> {(provider, model): Aggregate}
+        self.prompt_types = {}  # bucket start -> Counter of prompt types
+        self.terms = {}         # bucket start -> Counter of words in the free text prompts
+        self._rows_seen = 0
+        self._generation = generation
+
+    def update(self, df, generation):
+        """Aggregate the rows of df (the reader's log) not seen yet."""
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+            new_rows = df.iloc[self._rows_seen:]
+            if new_rows.empty:
+                return
+            bucket_starts = new_rows['timestamp'].dt.floor(self.freq)
+            grouped = new_rows.groupby([bucket_starts, 'provider', 'model'], observed=True, sort=False)['elapsed_time']
+            for (bucket_start, provider, model), values in grouped:
+                bucket = self.buckets.setdefault(bucket_start, {})
+                bucket.setdefault((provider, model), Aggregate()).add_many(values.to_numpy())
+
+            # prompts are categorized and tokenized once, when they are first seen
+            types = prompt_types(categorize_prompts(new_rows['user_prompt']))
+            for (bucket_start, prompt_type), count in types.groupby([bucket_starts, types], sort=False).size().items():
+                self.prompt_types.setdefault(bucket_start, Counter())[prompt_type] += count
+            terms = extract_terms(new_rows['user_prompt'][types == 'Other'])
+            if not terms.empty:
+                term_counts = terms.groupby([bucket_starts.loc[terms.index], terms], sort=False).size()
+                for (bucket_start, term), count in term_counts.items():
+                    self.terms.setdefault(bucket_start, Counter())[term] += count
+            self._rows_seen = len(df)
+
+    def query(self, start, end):
+        """{(provider, model): Aggregate} merged over the buckets in [start, end)."""
+        merged = {}
+        with self._lock:
+            for bucket_start in sorted(self.buckets):
+                if start <= bucket_start < end:
+                    for key, aggregate in self.buckets[bucket_start].items():
+                        merged.setdefault(key, Aggregate()).merge(aggregate)
+        return merged
+
+    def _merge_counters(self, counters, start, end):
+        merged = Counter()
+        with self._lock:
+            for bucket_start, counter in counters.items():
+                if start <= bucket_start < end:
+                    merged.update(counter)
+        return merged
+
+    def query_prompt_types(self, start, end):
+        """Counter of prompt types over the buckets in [start, end)."""
+        return self._merge_counters(self.prompt_types, start, end)
+
+    def query_terms(self, start, end):
+        """Counter of words in the free text prompts over the buckets in [start, end)."""
+        return self._merge_counters(self.terms, start, end)
+
+def rows_in_range(df, start, end):
+    """Rows of the log with start <= timestamp < end."""
+    timestamps = df['timestamp']
+    if timestamps.is_monotonic_increasing:
+        # the log is appended in time order: two binary searches instead of a full mask
+        return df.iloc[timestamps.searchsorted(start):timestamps.searchsorted(end)]
+    return df.loc[(timestamps >= start) & (timestamps < end)]
+
+def merge_aggregates(aggregates):
+    total = Aggregate()
+    for aggregate in aggregates:
+        total.merge(aggregate)
+    return total
+
+@st.cache_resource(show_spinner=False)
+def get_chat_rollups():
+    return ChatRollups()
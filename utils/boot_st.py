@@ -3,14 +3,18 @@
 
 import streamlit as st
 from utils.settings_st import *
-from sqlalchemy import create_engine, MetaData
+import sqlite3
+import time
+import threading
+import importlib
+import importlib.util
+import urllib.request
+import json
+from collections.abc import Mapping
+from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy.pool import QueuePool
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
-from llama_index.llms.ollama import Ollama
-from llama_index.llms.groq import Groq
-from llama_index.llms.cohere import Cohere
-from llama_index.llms.azure_openai import AzureOpenAI
-from llama_index.llms.openai import OpenAI
-import pandas as pd
+from utils.metrics_st import ChatMetrics
 
 
 # 01_chatbot_assistant.py
@@ -36,21 +40,9 @@ def init_page_chatbot():
             ChatMessage(role=MessageRole.ASSISTANT, content=chinook_reply_05),
         ]
 
-    # Initialize or load the metadata DataFrame
-    if 'metadata_df' not in st.session_state:
-        st.session_state.metadata_df = pd.DataFrame({
-            'timestamp': pd.Series(dtype='datetime64[ns]'),
-            'message_index': pd.Series(dtype=int),
-            'provider': pd.Series(dtype=str),
-            'model': pd.Series(dtype=str),
-            'user_prompt': pd.Series(dtype=str),
-            'elapsed_time': pd.Series(dtype=float),
-            'total_messages': pd.Series(dtype=int),
-            'estimated_prompt_tokens': pd.Series(dtype=int),
-            'estimated_response_tokens': pd.Series(dtype=int),
-            'estimated_total_tokens': pd.Series(dtype=int)
-        })
-
+    # Initialize the store for the metadata of each answer
+    if 'chat_metrics' not in st.session_state:
+        st.session_state.chat_metrics = ChatMetrics()
 
     return
 
@@ -65,16 +57,57 @@ def init_page_database():
     if "messages_db" not in st.session_state.keys():  # Initialize the chat messages history
         st.session_state.messages_db = []
 
-    # Initialize the query_history in session state if not present
-    if 'query_history' not in st.session_state:
-        st.session_state.query_history = {}
+    # st.session_state.query_history is created by init_query_history() in utils/query_history_st.py
 
     return
 
+def _set_journal_mode(path):
+    # the journal mode is persistent in the file, so it only needs a writable connection once
+    try:
+        connection = sqlite3.connect(path)
+        try:
+            current_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+            if current_mode.lower() != db_journal_mode.lower():
+                connection.execute(f"PRAGMA journal_mode={db_journal_mode}")
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        print(f"Could not set journal_mode={db_journal_mode} on {path}: {e}")
+
+def create_db_engine(path=path_to_db_file):
+    """Pooled, read-optimized SQLite engine configured from utils/settings_st.py."""
+    if db_journal_mode and not db_immutable:
+        _set_journal_mode(path)
+
+    uri_params = []
+    if db_read_only:
+        uri_params.append("mode=ro")
+    if db_immutable:
+        uri_params.append("immutable=1")
+    uri_params.append("uri=true")
+    engine = create_engine(
+        f"sqlite+pysqlite:///file:{path}?{'&'.join(uri_params)}",
+        poolclass=QueuePool,
+        pool_size=db_pool_size,
+        max_overflow=db_max_overflow,
+        pool_timeout=db_pool_timeout,
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(engine, "connect")
+    def tune_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in db_pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if db_read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    return engine
+
 @st.cache_resource(show_spinner=True)
 def get_db():
-    connection_string = db_url
-    engine = create_engine(connection_string)
+    engine = create_db_engine()
     metadata_obj = MetaData()
     # reflect the database schema into the SQLAlchemy object
     metadata_obj.reflect(bind=engine)
@@ -82,43 +115,144 @@ def get_db():
     return engine, metadata_obj
 
 # 01_chatbot_assistant.py
-# Initialize all LLM models
+# Provider SDKs are only imported when one of their models is first used
+llm_provider_classes = {
+    "Ollama": ("llama_index.llms.ollama", "Ollama"),
+    "Groq": ("llama_index.llms.groq", "Groq"),
+    "Cohere": ("llama_index.llms.cohere", "Cohere"),
+    "AzureOpenAI": ("llama_index.llms.azure_openai", "AzureOpenAI"),
+    "OpenAI": ("llama_index.llms.openai", "OpenAI"),
+}
+
+# secrets each provider needs
+llm_provider_secrets = {
+    "Ollama": [],
+    "Groq": ["GROQ_API_KEY"],
+    "Cohere": ["COHERE_API_KEY"],
+    "AzureOpenAI": ["AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT"],
+    "OpenAI": ["OPENAI_API_KEY"],
+}
+
+# ask OpenAI/Azure to report token usage at the end of streamed answers
+# (LlamaIndex drops stream_options on non-streaming calls)
+stream_usage_kwargs = {"stream_options": {"include_usage": True}}
+
+def _llm_kwargs(provider, model):
+    if provider == "Ollama":
+        # num_ctx is sent with every request: a fixed value avoids reloading the model when it changes
+        return {
+            "model": model,
+            "base_url": ollama_base_url,
+            "keep_alive": ollama_keep_alive,
+            "context_window": model_context_windows.get(model, default_context_window),
+        }
+    elif provider == "Groq":
+        return {"model": model, "api_key": st.secrets.get("GROQ_API_KEY")}
+    elif provider == "Cohere":
+        return {"model": model, "api_key": st.secrets.get("COHERE_API_KEY")}
+    elif provider == "AzureOpenAI":
+        return {
+            "engine": model,
+            "model": model,
+            "azure_endpoint": st.secrets.get("AZURE_OPENAI_ENDPOINT"),
+            "api_key": st.secrets.get("AZURE_OPENAI_API_KEY"),
+            "api_version": azure_openai_api_version,
+            "additional_kwargs": stream_usage_kwargs,
+        }
+    elif provider == "OpenAI":
+        return {"model": model, "api_key": st.secrets.get("OPENAI_API_KEY"), "additional_kwargs": stream_usage_kwargs}
+    raise KeyError(provider)
+
+def _probe_provider(provider):
+    """Returns None if the provider can be used, otherwise the reason why not."""
+    module_name, _ = llm_provider_classes[provider]
+    try:
+        if importlib.util.find_spec(module_name) is None:
+            return f"{module_name} is not installed"
+    except ModuleNotFoundError:
+        return f"{module_name} is not installed"
+    try:
+        missing = [name for name in llm_provider_secrets[provider] if not st.secrets.get(name)]
+    except FileNotFoundError:  # no secrets.toml at all
+        missing = llm_provider_secrets[provider]
+    if missing:
+        return f"{', '.join(missing)} not found in secrets"
+    if provider == "Ollama":
+        try:
+            urllib.request.urlopen(f"{ollama_base_url}/api/tags", timeout=1).close()
+        except OSError:
+            return f"Ollama server not reachable at {ollama_base_url}"
+    return None
+
+class LLMRegistry(Mapping):
+    """Mapping of (provider, model) to LLM clients, built lazily.
+
+    Only models of available providers are listed. The provider SDK is imported and
+    the client created the first time a model is looked up.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._probes = {}  # provider -> (time of the probe, reason it is unavailable or None)
+        self._lock = threading.Lock()
+
+    def unavailable_reason(self, provider):
+        checked_at, reason = self._probes.get(provider, (None, None))
+        if checked_at is None or time.monotonic() - checked_at > llm_probe_ttl:
+            reason = _probe_provider(provider)
+            self._probes[provider] = (time.monotonic(), reason)
+        return reason
+
+    def unavailable_providers(self):
+        """{provider: reason} for every provider whose models can't be used right now."""
+        providers = dict.fromkeys(provider for provider, _ in models)
+        return {provider: reason for provider in providers
+                if (reason := self.unavailable_reason(provider)) is not None}
+
+    def __contains__(self, key):
+        return key in models and self.unavailable_reason(key[0]) is None
+
+    def __iter__(self):
+        return (key for key in models if key in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        with self._lock:
+            if key not in self._clients:
+                provider, model = key
+                module_name, class_name = llm_provider_classes[provider]
+                llm_class = getattr(importlib.import_module(module_name), class_name)
+                self._clients[key] = llm_class(**_llm_kwargs(provider, model))
+            return self._clients[key]
+
+def _warm_up_ollama(model):
+    # a request without a prompt only loads the model into memory
+    request = urllib.request.Request(
+        f"{ollama_base_url}/api/generate",
+        data=json.dumps({
+            "model": model,
+            "keep_alive": ollama_keep_alive,
+            "options": {"num_ctx": model_context_windows.get(model, default_context_window)},
+        }).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        urllib.request.urlopen(request, timeout=300).close()
+    except OSError as e:
+        print(f"Could not warm up the Ollama model {model}: {e}")
+
+@st.cache_resource(show_spinner=False, ttl=llm_warmup_ttl)
+def warm_up_model(provider, model):
+    """Load a local model in the background, so the first question doesn't pay for it."""
+    if llm_warmup and provider == "Ollama":
+        threading.Thread(target=_warm_up_ollama, args=(model,), daemon=True).start()
+    return True
+
+# Initialize the registry of LLM models, clients are only created when first used
 @st.cache_resource(show_spinner=True)
 def initialize_llms():
-    llms = {}
-    for provider, model in models:
-        if provider == "Ollama":
-            llms[(provider, model)] = Ollama(model=model)
-        elif provider == "Groq":
-            groq_api_key = st.secrets.get("GROQ_API_KEY")
-            if not groq_api_key:
-                st.error("Groq API key not found in secrets. Groq models will not be available.")
-            else:
-                llms[(provider, model)] = Groq(model=model, api_key=groq_api_key)
-        elif provider == "Cohere":
-            cohere_api_key = st.secrets.get("COHERE_API_KEY")
-            if not cohere_api_key:
-                st.error("Cohere API key not found in secrets. Cohere models will not be available.")
-            else:
-                llms[(provider, model)] = Cohere(model=model, api_key=cohere_api_key)
-        elif provider == "AzureOpenAI":
-            azure_openai_api_key = st.secrets.get("AZURE_OPENAI_API_KEY")
-            azure_openai_endpoint = st.secrets.get("AZURE_OPENAI_ENDPOINT")
-            if not azure_openai_api_key or not azure_openai_endpoint:
-                st.error("Azure OpenAI API key or endpoint not found in secrets. Azure OpenAI models will not be available.")
-            else:
-                llms[(provider, model)] = AzureOpenAI(
-                    engine=model,
-                    model=model,
-                    azure_endpoint=azure_openai_endpoint,
-                    api_key=azure_openai_api_key,
-                    api_version=azure_openai_api_version,
-                )
-        elif provider == "OpenAI":
-            openai_api_key = st.secrets.get("OPENAI_API_KEY")
-            if not openai_api_key:
-                st.error("OpenAI API key not found in secrets. OpenAI models will not be available.")
-            else:
-                llms[(provider, model)] = OpenAI(model=model, api_key=openai_api_key)
-    
-    return llms
\ No newline at end of file
+    return LLMRegistry()
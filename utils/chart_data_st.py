@@ -0,0 +1,125 @@
+# utils/chart_data_st.py
+# reduces query results to what a chart can show before they are sent to the browser
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype, is_datetime64_any_dtype
+from utils.settings_st import chart_max_points, chart_bar_top_n, chart_webgl_points
+
+# column added to binned scatter data, with the number of rows in each cell
+bin_count_column = "row_count"
+
+def _as_numbers(series):
+    """Values usable for distances: numbers as floats, datetimes as nanoseconds, anything else by position."""
+    if is_datetime64_any_dtype(series):
+        return series.astype("int64").to_numpy(float)
+    if is_numeric_dtype(series):
+        return series.to_numpy(float)
+    return np.arange(len(series), dtype=float)
+
+def min_max_indices(y, buckets):
+    """Positions of the first, last, smallest and largest value of each of buckets equal slices of y."""
+    bucket = np.arange(len(y)) * buckets // len(y)
+    grouped = pd.Series(y).groupby(bucket)
+    indices = np.concatenate([
+        grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy(),
+        np.searchsorted(bucket, np.arange(buckets)), np.searchsorted(bucket, np.arange(buckets), side="right") - 1,
+    ])
+    return np.unique(indices)
+
+def lttb_indices(x, y, n_out):
+    """Positions of the points kept by Largest-Triangle-Three-Buckets downsampling to n_out points."""
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    every = (n - 2) / (n_out - 2)
+    kept = np.empty(n_out, dtype=int)
+    kept[0] = a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # keep the point of the bucket making the largest triangle with the previous kept point and the next bucket
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        kept[i + 1] = a
+    kept[-1] = n - 1
+    return kept
+
+def _reduce_line(df, x_column, y_column, max_points):
+    df = df.sort_values(x_column, kind="stable") if is_numeric_dtype(df[x_column]) or is_datetime64_any_dtype(df[x_column]) else df
+    df = df.reset_index(drop=True)
+    x = _as_numbers(df[x_column])
+    y = df[y_column].to_numpy(float)
+    if len(df) > 4 * max_points:
+        # min-max first: cheap, and keeps the peaks LTTB would pick anyway
+        indices = min_max_indices(y, max_points)
+        df, x, y = df.iloc[indices].reset_index(drop=True), x[indices], y[indices]
+    indices = lttb_indices(x, y, max_points)
+    return df.iloc[indices], "downsampled with LTTB"
+
+def _reduce_scatter(df, x_column, y_column, max_points):
+    if not is_numeric_dtype(df[x_column]):
+        return df.sample(max_points, random_state=0).sort_index(), "random sample"
+    # a grid of about max_points cells, each drawn once at its center, sized by its number of rows
+    bins = max(int(np.sqrt(max_points)), 1)
+    counts, x_edges, y_edges = np.histogram2d(df[x_column].to_numpy(float), df[y_column].to_numpy(float), bins=bins)
+    x_index, y_index = np.nonzero(counts)
+    reduced = pd.DataFrame({
+        x_column: (x_edges[x_index] + x_edges[x_index + 1]) / 2,
+        y_column: (y_edges[y_index] + y_edges[y_index + 1]) / 2,
+        bin_count_column: counts[x_index, y_index].astype(int),
+    })
+    return reduced, f"binned into a {bins}x{bins} grid, point size is the number of rows"
+
+def _reduce_bar(df, x_column, y_column, top_n):
+    # bars of the same category are stacked by both libraries, so summing them doesn't change the chart
+    totals = df.groupby(x_column, sort=False, observed=True)[y_column].sum()
+    if len(totals) <= top_n:
+        return totals.reset_index(), None
+    if is_numeric_dtype(df[x_column]) or is_datetime64_any_dtype(df[x_column]):
+        # an ordered axis: top N would leave gaps, sum equal-width ranges instead, labelled by their start
+        ranges = pd.cut(df[x_column], top_n)
+        binned = df.groupby(ranges, observed=True)[y_column].sum()
+        binned.index = [interval.left for interval in binned.index]
+        reduced = binned.rename_axis(x_column).reset_index()
+        return reduced, f"{len(totals)} values of {x_column} grouped into {top_n} ranges"
+    top = totals.nlargest(top_n)
+    other = pd.Series([totals.drop(top.index).sum()], index=["Other"])
+    reduced = pd.concat([top, other]).rename_axis(x_column).rename(y_column).reset_index()
+    return reduced, f"top {top_n} of {len(totals)} categories, the rest summed as Other"
+
+def _reduce_bar_single(df, column, top_n):
+    # x and y are the same column: each distinct value is drawn once, as a bar as high as the value
+    values = df[column].drop_duplicates()
+    if len(values) > top_n:
+        return values.nlargest(top_n).to_frame(), f"the {top_n} largest of {len(values)} distinct values of {column}"
+    if len(values) < len(df):
+        return values.to_frame(), f"{len(df)} rows drawn as {len(values)} distinct values"
+    return df, None
+
+def reduce_chart_data(df, chart_type, x_column, y_column, max_points=chart_max_points, top_n=chart_bar_top_n):
+    """The data to draw for a chart of df, and a note on how it was reduced (None if it wasn't).
+
+    Line charts are downsampled (min-max, then LTTB), scatter plots binned on a grid and
+    bar charts limited to the top_n categories plus Other.
+    """
+    # a single column plotted against itself is reduced like any other pair
+    df = df[list(dict.fromkeys([x_column, y_column]))].dropna()
+    if chart_type == "bar" and x_column == y_column:
+        return _reduce_bar_single(df, x_column, top_n)
+    if chart_type == "bar":
+        return _reduce_bar(df, x_column, y_column, top_n)
+    if len(df) <= max_points:
+        return df, None
+    if chart_type == "line":
+        reduced, method = _reduce_line(df, x_column, y_column, max_points)
+    else:
+        reduced, method = _reduce_scatter(df, x_column, y_column, max_points)
+    return reduced, f"{len(df)} rows {method}, {len(reduced)} points drawn"
+
+def use_webgl(df):
+    """Whether Plotly should draw df with WebGL instead of SVG."""
+    return len(df) > chart_webgl_points
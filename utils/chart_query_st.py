@@ -0,0 +1,91 @@
+# utils/chart_query_st.py
+# plans chart queries that let SQLite aggregate a stored result, so only the series reaches Python
+
+import pandas as pd
+from utils.boot_st import get_db
+from utils.query_st import execute_cached_sql_query, validate_read_only
+from utils.settings_st import chart_max_points
+
+# aggregates offered by the chart pages, "none" plots the raw rows
+chart_aggregates = {
+    "none": None,
+    "sum": "SUM",
+    "avg": "AVG",
+    "count": "COUNT",
+    "min": "MIN",
+    "max": "MAX",
+}
+
+def quote_identifier(name):
+    # backticks rather than double quotes: SQLite reads an unknown "name" as a string literal
+    return '`' + str(name).replace('`', '``') + '`'
+
+def _subquery(query):
+    # the newline keeps a trailing -- comment from swallowing the closing parenthesis
+    return "(\n" + query.strip().rstrip(";").strip() + "\n)"
+
+def plan_chart_query(query, x_column, y_column, aggregate, chart_type, bin_width=None, bin_start=None,
+                     limit=chart_max_points):
+    """SQL for AGG(y) by x over the result of query.
+
+    With bin_width, numeric x values are grouped into ranges of that width (labelled by their start).
+    Bar charts are ordered by the aggregated value, largest first; other charts by x.
+    """
+    x = quote_identifier(x_column)
+    y = quote_identifier(y_column)
+    group = x
+    if bin_width:
+        group = f"({bin_start} + CAST(({x} - {bin_start}) * 1.0 / {bin_width} AS INTEGER) * {bin_width})"
+    order = f"{y} DESC" if chart_type == "bar" else x
+    return (f"SELECT {group} AS {x}, {chart_aggregates[aggregate]}({y}) AS {y}\n"
+            f"FROM {_subquery(query)}\n"
+            f"WHERE {x} IS NOT NULL\n"
+            f"GROUP BY 1\n"
+            f"ORDER BY {order}\n"
+            f"LIMIT {int(limit)}")
+
+def plan_x_stats_query(query, x_column):
+    """SQL for the number of distinct values, the range and the type of the x column."""
+    x = quote_identifier(x_column)
+    return (f"SELECT COUNT(DISTINCT {x}) AS n, MIN({x}) AS lo, MAX({x}) AS hi, typeof(MIN({x})) AS kind\n"
+            f"FROM {_subquery(query)}")
+
+def run_chart_query(query, x_column, y_column, aggregate, chart_type, max_groups=chart_max_points):
+    """The aggregated series as a DataFrame (x_column, y_column), or an error message.
+
+    Numeric x columns with more than max_groups distinct values are binned into max_groups ranges.
+    """
+    error = validate_read_only(query)
+    if error is not None:
+        return error
+    if x_column == y_column:
+        # the series would need two columns of the same name
+        return "choose different X and Y columns to aggregate Y by X"
+    engine, _ = get_db()
+    bin_width = bin_start = None
+    if chart_type != "bar":
+        stats = execute_cached_sql_query(plan_x_stats_query(query, x_column), engine)
+        if not isinstance(stats, pd.DataFrame):
+            return stats
+        n, lo, hi, kind = stats.iloc[0]
+        if kind in ("integer", "real") and n > max_groups and hi > lo:
+            bin_start = lo
+            bin_width = (hi - lo) / (max_groups - 1)  # so the largest value still falls in the last range
+    sql = plan_chart_query(query, x_column, y_column, aggregate, chart_type, bin_width, bin_start, limit=max_groups + 1)
+    response = execute_cached_sql_query(sql, engine)
+    if not isinstance(response, pd.DataFrame):
+        return response
+    # a new frame: the response may be the one held by the result cache
+    series = response.iloc[:max_groups]
+    series.attrs = {**response.attrs, "chart_sql": sql, "binned": bin_width is not None,
+                    "groups_truncated": len(response) > max_groups}
+    return series
+
+def describe_chart_query(df):
+    """One line note on an aggregated series, for the caption under the chart."""
+    note = f"Aggregated by SQLite into {len(df)} groups"
+    if df.attrs.get("binned"):
+        note += " of equal x ranges"
+    if df.attrs.get("groups_truncated"):
+        note += ", more groups were left out"
+    return note
@@ -0,0 +1,62 @@
+# utils/chat_history_st.py
+# keeps the prompt sent to each model within its context window
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from utils.settings_st import (model_context_windows, default_context_window, response_token_reserve,
+                               chat_max_history_tokens, chat_summary_tokens, chat_preamble_length)
+from utils.tokens_st import count_tokens, count_message_tokens, message_overhead_tokens
+
+def context_window(model):
+    return model_context_windows.get(model, default_context_window)
+
+def _summarize(dropped_messages, budget, model):
+    """Extractive summary of the turns that were dropped: the user's earlier questions, newest first."""
+    header = "Summary of the earlier part of this conversation. The user previously asked:"
+    lines = []
+    used = count_tokens(header, model) + message_overhead_tokens
+    for message in reversed(dropped_messages):
+        if message.role != MessageRole.USER:
+            continue
+        line = "- " + " ".join((message.content or "").split())[:300]
+        cost = count_tokens(line, model)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return None
+    return ChatMessage(role=MessageRole.SYSTEM, content="\n".join([header] + lines))
+
+def build_prompt_messages(messages, model, preamble=None):
+    """The messages to send to model: the pinned preamble plus as many recent turns as fit.
+
+    preamble defaults to the first chat_preamble_length messages. Turns that no longer fit
+    are replaced by a short summary of what the user asked in them.
+    """
+    if preamble is None:
+        preamble = messages[:chat_preamble_length]
+    turns = messages[chat_preamble_length:]
+    preamble_tokens = sum(count_message_tokens(message, model) for message in preamble)
+    budget = min(context_window(model) - response_token_reserve - preamble_tokens, chat_max_history_tokens)
+
+    if sum(count_message_tokens(message, model) for message in turns) <= budget:
+        return list(preamble) + list(turns)
+
+    # walk back from the newest turn until the window is full, leaving room for the summary
+    window_budget = budget - chat_summary_tokens
+    kept = []
+    used = 0
+    for message in reversed(turns):
+        cost = count_message_tokens(message, model)
+        if kept and used + cost > window_budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    # the window should start with a question, not with an answer to a dropped one
+    while len(kept) > 1 and kept[0].role == MessageRole.ASSISTANT:
+        kept.pop(0)
+
+    dropped = turns[:len(turns) - len(kept)]
+    summary = _summarize(dropped, chat_summary_tokens, model) if chat_summary_tokens > 0 else None
+    return list(preamble) + ([summary] if summary else []) + kept
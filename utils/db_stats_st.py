@@ -0,0 +1,61 @@
+# utils/db_stats_st.py
+# cached, change-aware statistics about the Chinook database schema
+
+import os
+import sqlite3
+import threading
+import streamlit as st
+import pandas as pd
+from sqlalchemy import text
+from utils.settings_st import path_to_db_file, schema_stats_ttl
+from utils.boot_st import get_db
+
+
+# A single long-lived connection used only to watch the database for changes.
+# PRAGMA data_version is per connection: it changes whenever another connection
+# commits to the file, so it must be read from the same connection every time.
+@st.cache_resource(show_spinner=False)
+def _get_version_watcher():
+    connection = sqlite3.connect(f"file:{path_to_db_file}?mode=ro", uri=True, check_same_thread=False)
+    return connection, threading.Lock()
+
+def get_db_version():
+    """Cheap token that changes whenever the SQLite file (or its WAL) is modified."""
+    connection, lock = _get_version_watcher()
+    with lock:
+        data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+    mtimes = []
+    for path in (path_to_db_file, f"{path_to_db_file}-wal"):
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(0)
+    return (*mtimes, data_version)
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def _schema_stats_query(table_names):
+    # one UNION ALL query collects every statistic for every table in a single round trip
+    selects = []
+    for name in table_names:
+        selects.append(
+            f"SELECT {_quote_literal(name)} AS table_name, "
+            f"(SELECT COUNT(*) FROM {_quote_identifier(name)}) AS row_count, "
+            f"(SELECT COUNT(*) FROM pragma_table_info({_quote_literal(name)})) AS column_count, "
+            f"(SELECT COUNT(*) FROM pragma_foreign_key_list({_quote_literal(name)})) AS foreign_key_count, "
+            f"(SELECT COUNT(*) FROM pragma_index_list({_quote_literal(name)})) AS index_count"
+        )
+    return "\nUNION ALL\n".join(selects)
+
+# db_version is only part of the cache key: a new version forces a refresh before the TTL expires
+@st.cache_data(ttl=schema_stats_ttl, show_spinner=False)
+def get_schema_stats(db_version):
+    """Row, column, foreign key and index counts for every table, as a DataFrame."""
+    engine, metadata = get_db()
+    with engine.connect() as connection:
+        result = connection.execute(text(_schema_stats_query(metadata.tables.keys())))
+        return pd.DataFrame(result.fetchall(), columns=result.keys())
@@ -0,0 +1,48 @@
+# utils/figure_cache_st.py
+# charts built once per result and chart options, shared by all sessions
+
+import threading
+from collections import OrderedDict
+import streamlit as st
+from utils.query_st import result_fingerprint
+from utils.settings_st import figure_cache_entries
+
+
+class FigureCache:
+    """LRU cache of built charts, as serialized Plotly and Vega-Lite spec dicts, with their notes.
+
+    Keys are (result fingerprint, chart type, x column, y column, library, aggregate), so the same chart
+    of the same data is only built once, whichever page or session asks for it.
+    """
+
+    def __init__(self, max_entries=figure_cache_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        """The cached value for key, or the result of build() which is then cached."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = build()  # outside the lock, building a chart can take a while
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache():
+    return FigureCache()
+
+def cached_chart_spec(df, chart_type, x_column, y_column, library, build, aggregate="none"):
+    """(spec, note) for a chart of the result df; build() makes it on a cache miss."""
+    key = (result_fingerprint(df), chart_type, x_column, y_column, library, aggregate)
+    return get_figure_cache().get_or_build(key, build)
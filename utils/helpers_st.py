@@ -2,23 +2,72 @@
 import streamlit as st
 import pandas as pd
 import time
-import os
+import queue
+import threading
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from utils.boot_st import initialize_llms
+from utils.chat_history_st import build_prompt_messages
+from utils.tokens_st import token_usage
+from utils.telemetry_st import get_telemetry_writer
+from utils.metrics_st import ChatMetricsRecord
+from utils.response_cache_st import get_response_cache, preamble_hash
+from utils.sql_pipeline_st import run_generated_sql
+from utils.schema_retriever_st import get_schema_retriever
+from utils.settings_st import chat_preamble_length, chat_auto_execute_sql, chat_dynamic_schema, prefix_cache_providers
 
 # Display chat messages
 def display_chat_history():
-    for idx, message in enumerate(st.session_state.messages_chatbot[11:], start=1):  # Skip the system message and training prompts
+    # Skip the system message and training prompts, idx is the position in messages_chatbot
+    for idx, message in enumerate(st.session_state.messages_chatbot[chat_preamble_length:], start=chat_preamble_length):
         with st.chat_message(message.role.value):
             st.write(message.content)
         if message.role == MessageRole.ASSISTANT:
-            metadata = st.session_state.metadata_df[st.session_state.metadata_df['message_index'] == idx]
-            if not metadata.empty:
-                st.caption(f"Answered by: {metadata['provider'].values[0]} - {metadata['model'].values[0]}")
+            metadata = st.session_state.chat_metrics.get(idx)
+            if metadata is not None:
+                source = " (from cache)" if metadata.token_source == "cache" else ""
+                st.caption(f"Answered by: {metadata.provider} - {metadata.model}{source}")
 
-def estimate_tokens(text: str) -> int:
-    """Rough estimation of tokens based on word count."""
-    return len(text.split())
+def stream_chat_response(llm, messages, timings):
+    """Yield the LLM answer as it streams in, recording first/last token times in timings."""
+    timings["start_time"] = time.time()
+    for chunk in llm.stream_chat(messages):
+        if chunk.delta and "first_token_time" not in timings:
+            timings["first_token_time"] = time.time()
+        timings["last_response"] = chunk
+        yield chunk.delta or ""
+    timings["end_time"] = time.time()
+    timings.setdefault("first_token_time", timings["end_time"])
+
+def question_preamble(question, provider):
+    """System prompt and examples to send with question: only the relevant schema with chat_dynamic_schema.
+
+    Providers with automatic prompt caching always get the full preamble, an identical prefix they don't re-process.
+    """
+    if chat_dynamic_schema and provider not in prefix_cache_providers:
+        return get_schema_retriever().build_preamble(question)
+    return st.session_state.messages_chatbot[:chat_preamble_length]
+
+def answer_metrics(provider, model, user_input, timings, prompt_messages, response_text):
+    """Timing and token usage of one answer, as ChatMetrics values."""
+    # Token usage of the whole request: reported by the provider, or counted with a local tokenizer
+    usage = token_usage(timings.get("last_response"), prompt_messages, response_text, model)
+    generation_time = timings["end_time"] - timings["first_token_time"]
+    return {
+        'timestamp': pd.Timestamp.now(),
+        'provider': provider,
+        'model': model,
+        'user_prompt': user_input,
+        'elapsed_time': timings["end_time"] - timings["start_time"],
+        'time_to_first_token': timings["first_token_time"] - timings["start_time"],
+        'tokens_per_second': usage["completion_tokens"] / generation_time if generation_time > 0 else 0.0,
+        **usage,
+    }
+
+def log_answer(record):
+    # Queue the metadata for the log file, excluding 'message_index' (written in the background)
+    log_row = record.as_dict()
+    del log_row['message_index']
+    get_telemetry_writer().log(log_row)
 
 def get_user_input():
     llms = initialize_llms()
@@ -31,54 +80,146 @@ def get_user_input():
         st.session_state.messages_chatbot.append(user_message)
         with st.chat_message("user"):
             st.write(user_input)
-        
-        # Estimate tokens for user input
-        user_tokens = estimate_tokens(user_input)
 
-        # Generate LLM response
+        # Repeated questions are answered from the response cache
+        response_cache = get_response_cache()
+        preamble_messages = question_preamble(user_input, st.session_state.selected_provider)
+        # the earlier turns are part of the key: follow-ups like "why?" only make sense in their conversation
+        context = preamble_hash(preamble_messages + st.session_state.messages_chatbot[chat_preamble_length:-1])
+        lookup_start = time.time()
+        cached = response_cache.lookup(st.session_state.selected_model, user_input, context)
+        if cached is not None:
+            get_cached_answer(user_input, cached, time.time() - lookup_start)
+            return
+
+        # Generate LLM response, rendering tokens as they arrive
         with st.chat_message("assistant"):
             with st.spinner(f"Generating response using {st.session_state.selected_model}..."):
                 llm = llms[(st.session_state.selected_provider, st.session_state.selected_model)]
                 
-                start_time = time.time()
-                response = llm.chat(st.session_state.messages_chatbot)
-                end_time = time.time()
-                
-                elapsed_time = end_time - start_time
-                
-                st.write(response.message.content)
-        
-        # Estimate tokens for response
-        response_tokens = estimate_tokens(response.message.content)
+                # the full history stays in the session, the model only gets what fits its context window
+                prompt_messages = build_prompt_messages(st.session_state.messages_chatbot, st.session_state.selected_model,
+                                                        preamble=preamble_messages)
+                timings = {}
+                response_text = st.write_stream(stream_chat_response(llm, prompt_messages, timings))
+
+        metrics = answer_metrics(st.session_state.selected_provider, st.session_state.selected_model,
+                                 user_input, timings, prompt_messages, response_text)
+        response_cache.put(st.session_state.selected_model, user_input, context, response_text)
 
         # Add assistant message to chat history
         assistant_message = ChatMessage(
             role=MessageRole.ASSISTANT,
-            content=response.message.content,
+            content=response_text,
         )
         st.session_state.messages_chatbot.append(assistant_message)
 
-        # Update metadata DataFrame
-        new_metadata = pd.DataFrame({
-            'timestamp': [pd.Timestamp.now()],
-            'message_index': [len(st.session_state.messages_chatbot) - 1],
-            'provider': [st.session_state.selected_provider],
-            'model': [st.session_state.selected_model],
-            'user_prompt': [user_input],
-            'elapsed_time': [elapsed_time],
-            'total_messages': [len(st.session_state.messages_chatbot)],
-            'estimated_prompt_tokens': [user_tokens],
-            'estimated_response_tokens': [response_tokens],
-            'estimated_total_tokens': [user_tokens + response_tokens]
-        })
-        st.session_state.metadata_df = pd.concat([st.session_state.metadata_df, new_metadata], ignore_index=True)
-
-        # Append new metadata to CSV file, excluding 'message_index'
-        csv_path = "log/metadata.csv"
-        os.makedirs(os.path.dirname(csv_path), exist_ok=True)  # Ensure the directory exists
-        new_metadata_for_csv = new_metadata.drop(columns=['message_index'])
-        new_metadata_for_csv.to_csv(csv_path, mode='a', header=not os.path.exists(csv_path), index=False)
+        # Record the metadata of this answer
+        record = st.session_state.chat_metrics.append(
+            message_index=len(st.session_state.messages_chatbot) - 1,
+            total_messages=len(st.session_state.messages_chatbot),
+            **metrics,
+        )
+        log_answer(record)
 
         # Display model info for the current response
-        st.caption(f"Answered by: {st.session_state.selected_provider} - {st.session_state.selected_model} in {elapsed_time:.2f} seconds. Session total messages: {len(st.session_state.messages_chatbot)}")
-        st.caption(f"Estimated tokens - Prompt: {user_tokens}, Response: {response_tokens}, Total: {user_tokens + response_tokens}")
+        st.caption(f"Answered by: {record.provider} - {record.model} in {record.elapsed_time:.2f} seconds "
+                   f"(first token after {record.time_to_first_token:.2f} s, {record.tokens_per_second:.1f} tokens/s). Session total messages: {len(st.session_state.messages_chatbot)}")
+        cached = f", Cached prompt: {record.cached_tokens}" if record.cached_tokens is not None else ""
+        st.caption(f"Tokens ({record.token_source}) - Prompt: {record.prompt_tokens}, Response: {record.completion_tokens}, Total: {record.total_tokens}{cached}")
+
+        if st.session_state.get("auto_execute_sql", chat_auto_execute_sql):
+            run_generated_sql(response_text, record.elapsed_time)
+
+def get_cached_answer(user_input, cached, lookup_time):
+    """Show and record an answer served from the response cache.
+
+    It is added to the chat history like any answer, but not to the metadata log: no LLM was called.
+    """
+    response_text, similarity = cached
+    with st.chat_message("assistant"):
+        st.write(response_text)
+    st.session_state.messages_chatbot.append(ChatMessage(role=MessageRole.ASSISTANT, content=response_text))
+    st.session_state.chat_metrics.append(
+        timestamp=pd.Timestamp.now(),
+        message_index=len(st.session_state.messages_chatbot) - 1,
+        provider=st.session_state.selected_provider,
+        model=st.session_state.selected_model,
+        user_prompt=user_input,
+        elapsed_time=lookup_time,
+        time_to_first_token=lookup_time,
+        tokens_per_second=0.0,
+        total_messages=len(st.session_state.messages_chatbot),
+        prompt_tokens=0,
+        completion_tokens=0,
+        total_tokens=0,
+        token_source="cache",
+    )
+    match = "same question" if similarity >= 1.0 else f"similar question, similarity {similarity:.2f}"
+    st.caption(f"Answered from cache ({match}) for: {st.session_state.selected_provider} - {st.session_state.selected_model} "
+               f"in {lookup_time:.3f} seconds. Session total messages: {len(st.session_state.messages_chatbot)}")
+
+    if st.session_state.get("auto_execute_sql", chat_auto_execute_sql):
+        run_generated_sql(response_text, lookup_time)
+
+def _stream_to_queue(index, llm, messages, events):
+    # runs in a worker thread: only the main script thread may call Streamlit
+    timings = {}
+    try:
+        for delta in stream_chat_response(llm, messages, timings):
+            events.put((index, "delta", delta))
+        events.put((index, "done", timings))
+    except Exception as e:
+        events.put((index, "error", str(e)))
+
+def get_compare_input(model_keys):
+    """Send one question to several models at once, streaming each answer into its own column.
+
+    The answers are not added to the chat history; each model's timing and token usage is logged.
+    """
+    llms = initialize_llms()
+
+    user_input = st.chat_input(f"Ask the {len(model_keys)} selected models:")
+
+    if user_input:
+        with st.chat_message("user"):
+            st.write(user_input)
+
+        messages = st.session_state.messages_chatbot + [ChatMessage(role=MessageRole.USER, content=user_input)]
+        columns = st.columns(len(model_keys))
+        placeholders = []
+        prompts = []
+        for column, (provider, model) in zip(columns, model_keys):
+            column.markdown(f"**{provider} - {model}**")
+            placeholders.append(column.empty())
+            prompts.append(build_prompt_messages(messages, model, preamble=question_preamble(user_input, provider)))
+
+        # one thread per model, the answers are rendered here as their tokens arrive
+        events = queue.Queue()
+        for index, key in enumerate(model_keys):
+            threading.Thread(target=_stream_to_queue, args=(index, llms[key], prompts[index], events), daemon=True).start()
+        texts = [""] * len(model_keys)
+        outcomes = [None] * len(model_keys)
+        pending = len(model_keys)
+        while pending:
+            index, kind, payload = events.get()
+            if kind == "delta":
+                texts[index] += payload
+                placeholders[index].markdown(texts[index])
+            else:
+                outcomes[index] = (kind, payload)
+                pending -= 1
+
+        for index, (provider, model) in enumerate(model_keys):
+            kind, payload = outcomes[index]
+            with columns[index]:
+                if kind == "error":
+                    st.error(f"Error: {payload}")
+                    continue
+                metrics = answer_metrics(provider, model, user_input, payload, prompts[index], texts[index])
+                record = ChatMetricsRecord(total_messages=len(prompts[index]), **metrics)
+                log_answer(record)
+                st.caption(f"{record.elapsed_time:.2f} s, first token after {record.time_to_first_token:.2f} s, "
+                           f"{record.tokens_per_second:.1f} tokens/s")
+                st.caption(f"Tokens ({record.token_source}) - Prompt: {record.prompt_tokens}, "
+                           f"Response: {record.completion_tokens}, Total: {record.total_tokens}")
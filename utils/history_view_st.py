@@ -0,0 +1,75 @@
+# utils/history_view_st.py
+# paginated view of st.session_state.query_history, shared by the database and chart pages
+
+import streamlit as st
+from utils.query_history_st import init_query_history, render_evicted_entry
+from utils.settings_st import history_page_size, history_rows_per_page
+
+def render_dataframe_page(df, key, rows_per_page=history_rows_per_page):
+    """Show df one slice of rows at a time, so only that slice is sent to the browser."""
+    if len(df) <= rows_per_page:
+        st.dataframe(df)
+        return
+    pages = (len(df) - 1) // rows_per_page + 1
+    page = st.number_input(f"Page of rows (1-{pages})", min_value=1, max_value=pages, value=1, key=key)
+    start = (page - 1) * rows_per_page
+    end = min(start + rows_per_page, len(df))
+    st.dataframe(df.iloc[start:end])
+    st.caption(f"Rows {start + 1}-{end} of {len(df)}")
+
+def render_entry_result(query, entry, key):
+    """Show the stored result of a history entry: its error, a page of its rows, or the summary of an
+    evicted result. Returns the DataFrame, or None if there is an error or it stays on disk."""
+    if entry.error is not None:
+        st.error(entry.error)
+        return None
+    # read under the history's lock: another session may evict the result at any time
+    result = init_query_history().loaded_result(query)
+    if result is not None:
+        render_dataframe_page(result, key=f"{key}_rows")
+        return result
+    # evicted results only show their summary until they are loaded back
+    result = render_evicted_entry(query, entry, key=f"{key}_load")
+    if result is not None:
+        render_dataframe_page(result, key=f"{key}_rows")
+    return result
+
+def open_history_entry(key, query, page_size=history_page_size):
+    """Open the entry of query in the history view key, and turn to the page listing it."""
+    queries = list(init_query_history())
+    st.session_state[f"{key}_open"] = query
+    st.session_state[f"{key}_page"] = (len(queries) - 1 - queries.index(query)) // page_size + 1
+
+def render_query_history(key, render_entry, page_size=history_page_size):
+    """List the query history newest first, page_size queries per page.
+
+    Only the entry the user opened is rendered, by calling render_entry(query_number, query, entry);
+    the others are a single button each, so large results aren't sent on every rerun.
+    """
+    history = init_query_history()
+    items = history.items()
+    total_queries = len(items)
+    if total_queries == 0:
+        st.info("No queries yet.")
+        return
+
+    open_key = f"{key}_open"
+    if st.session_state.get(open_key) not in history:
+        st.session_state[open_key] = None
+
+    pages = (total_queries - 1) // page_size + 1
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page of queries (1-{pages})", min_value=1, max_value=pages, key=f"{key}_page")
+    first = total_queries - (page - 1) * page_size  # number of the newest query on this page
+
+    for query_number in range(first, max(first - page_size, 0), -1):
+        query, entry = items[query_number - 1]
+        is_open = st.session_state[open_key] == query
+        label = f"{'▾' if is_open else '▸'} Query {query_number} of {total_queries}: {query[:50]}..."
+        if st.button(label, key=f"{key}_toggle_{query_number}", use_container_width=True):
+            st.session_state[open_key] = None if is_open else query
+            st.rerun()
+        if is_open:
+            with st.container(border=True):
+                render_entry(query_number, query, entry)
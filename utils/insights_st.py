@@ -0,0 +1,202 @@
+# utils/insights_st.py
+# materialized rollups behind the "Data Insights" charts of the main dashboard
+
+import os
+import json
+import threading
+import streamlit as st
+import pandas as pd
+from sqlalchemy import text
+from utils.settings_st import insights_cache_dir, path_to_db_file
+from utils.boot_st import get_db
+
+# Each rollup is stored unlimited and unsorted, so rows appended to the source table
+# can be aggregated on their own and merged in. ORDER BY / LIMIT are applied when serving.
+# {where} is empty for a full rebuild, or filters the source table to the new rows.
+# depends_on lists the columns each rollup reads, their checksum tells updates apart from appends.
+insight_rollups = {
+    "top_artists": {
+        "source": ("Track", "TrackId"),
+        "depends_on": {"Artist": ["ArtistId", "Name"], "Album": ["AlbumId", "ArtistId"], "Track": ["TrackId", "AlbumId"]},
+        "keys": ["ArtistId", "Name"],
+        "measures": {"TrackCount": "sum"},
+        "sql": """
+        SELECT Artist.ArtistId, Artist.Name, COUNT(Track.TrackId) as TrackCount
+        FROM Artist
+        JOIN Album ON Artist.ArtistId = Album.ArtistId
+        JOIN Track ON Album.AlbumId = Track.AlbumId
+        {where}
+        GROUP BY Artist.ArtistId
+        """,
+    },
+    "genre_distribution": {
+        "source": ("Track", "TrackId"),
+        "depends_on": {"Genre": ["GenreId", "Name"], "Track": ["TrackId", "GenreId"]},
+        "keys": ["GenreId", "Name"],
+        "measures": {"TrackCount": "sum"},
+        "sql": """
+        SELECT Genre.GenreId, Genre.Name, COUNT(Track.TrackId) as TrackCount
+        FROM Genre
+        JOIN Track ON Genre.GenreId = Track.GenreId
+        {where}
+        GROUP BY Genre.GenreId
+        """,
+    },
+    "sales_over_time": {
+        "source": ("Invoice", "InvoiceId"),
+        "depends_on": {"Invoice": ["InvoiceId", "InvoiceDate", "Total"]},
+        "keys": ["Month"],
+        "measures": {"TotalSales": "sum"},
+        "sql": """
+        SELECT strftime('%Y-%m', InvoiceDate) as Month, SUM(Total) as TotalSales
+        FROM Invoice
+        {where}
+        GROUP BY Month
+        """,
+    },
+}
+
+_state_file = os.path.join(insights_cache_dir, "state.json")
+_refresh_lock = threading.Lock()
+
+def _rollup_path(name):
+    return os.path.join(insights_cache_dir, f"{name}.parquet")
+
+def _load_state():
+    try:
+        with open(_state_file) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _dump_state(state, path):
+    with open(path, "w") as f:
+        json.dump(state, f)
+
+_modulus = 2147483647  # keeps every row's hash, and the sum over millions of rows, within SQLite integers
+
+def _value_hash(name):
+    """SQL for an integer standing for the value of the column name.
+
+    Text is reduced to its length and its first, middle and last characters: cheap enough for
+    millions of rows, though an edit keeping those (and the length) goes unnoticed.
+    """
+    column = f'"{name}"'
+    text_hash = (f"length({column}) * 1000003 + unicode({column}) * 7919 + unicode(substr({column}, -1)) * 104729"
+                 f" + unicode(substr({column}, length({column}) / 2 + 1)) * 15485863")
+    return (f"CASE typeof({column}) WHEN 'integer' THEN {column} WHEN 'real' THEN CAST({column} * 10000 AS INTEGER)"
+            f" WHEN 'null' THEN -1 ELSE {text_hash} END")
+
+def _signature_sql(table, columns):
+    # each row's hash is weighted by its rowid, so moving values between rows changes the sum;
+    # rows up to :max_rowid (the previous refresh) and newer ones are summed apart, in one scan
+    row_value = " + ".join(f"({_value_hash(column)}) % {_modulus} * {1 + 40503 * i}"
+                           for i, column in enumerate(columns))
+    row_hash = f"({row_value}) % {_modulus} * (rowid % 65521 + 1) % {_modulus}"
+    return (f'SELECT COUNT(*), COALESCE(MAX(rowid), 0), COUNT(CASE WHEN rowid <= :max_rowid THEN 1 END),\n'
+            f'    COALESCE(SUM(CASE WHEN rowid <= :max_rowid THEN {row_hash} END), 0),\n'
+            f'    COALESCE(SUM(CASE WHEN rowid > :max_rowid THEN {row_hash} END), 0)\n'
+            f'FROM "{table}"')
+
+def _table_signature(connection, table, columns, saved):
+    """([row count, highest rowid, checksum], change) of table, change being one of
+    "unchanged", "appended" (the rows of the saved signature are untouched) or "changed"."""
+    old_count, old_max_rowid, old_checksum = saved or (None, 0, None)
+    count, max_rowid, old_rows, old_rows_checksum, new_rows_checksum = connection.execute(
+        text(_signature_sql(table, columns)), {"max_rowid": old_max_rowid}).one()
+    signature = [count, max_rowid, old_rows_checksum + new_rows_checksum]
+    if saved is None or old_rows != old_count or old_rows_checksum != old_checksum:
+        return signature, "changed"
+    return signature, "unchanged" if count == old_count else "appended"
+
+def _file_version():
+    # modification times of the database and its WAL, which survive a restart (PRAGMA data_version doesn't)
+    version = []
+    for path in (path_to_db_file, f"{path_to_db_file}-wal"):
+        try:
+            version.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            version.append(0)
+    return version
+
+def _table_columns():
+    """{table: columns read by any rollup}, so each table is scanned once per refresh."""
+    tables = {}
+    for spec in insight_rollups.values():
+        for table, columns in spec["depends_on"].items():
+            tables.setdefault(table, {}).update(dict.fromkeys(columns))
+    return {table: list(columns) for table, columns in tables.items()}
+
+def _refresh_rollup(connection, name, spec, saved, changes, signatures):
+    """Bring one rollup up to date; returns its new state entry."""
+    source_table, source_id = spec["source"]
+    path = _rollup_path(name)
+    table_changes = {changes[table] for table in spec["depends_on"]}
+
+    if saved and os.path.exists(path):
+        if table_changes == {"unchanged"}:
+            return saved
+        if "changed" not in table_changes:
+            # only the new source rows are aggregated, then merged into the stored rollup
+            delta_sql = spec["sql"].format(where=f"WHERE {source_table}.{source_id} > :last_id")
+            delta = pd.read_sql(text(delta_sql), connection, params={"last_id": saved["last_id"]})
+            rollup = pd.concat([pd.read_parquet(path), delta], ignore_index=True)
+            rollup = rollup.groupby(spec["keys"], as_index=False, sort=False).agg(spec["measures"])
+            _write_atomic(path, lambda tmp: rollup.to_parquet(tmp, index=False))
+            return {"last_id": signatures[source_table][1]}
+
+    # first build, or rows were updated/deleted: rebuild from scratch
+    rollup = pd.read_sql(text(spec["sql"].format(where="")), connection)
+    _write_atomic(path, lambda tmp: rollup.to_parquet(tmp, index=False))
+    return {"last_id": signatures[source_table][1]}
+
+def refresh_insights():
+    """Update every materialized rollup whose source tables changed since the last refresh.
+
+    Nothing is read while the database file is unchanged; otherwise each source table gets one
+    checksum scan in SQLite, shared by the rollups reading it.
+    """
+    engine, _ = get_db()
+    os.makedirs(insights_cache_dir, exist_ok=True)
+    with _refresh_lock:
+        state = _load_state()
+        file_version = _file_version()
+        if (state.get("file_version") == file_version and
+                all(name in state and os.path.exists(_rollup_path(name)) for name in insight_rollups)):
+            return
+        saved_tables = state.get("tables", {})
+        tables = {}
+        changes = {}
+        with engine.connect() as connection:
+            for table, columns in _table_columns().items():
+                saved = saved_tables.get(table)
+                if saved is not None and saved["columns"] != columns:
+                    saved = None
+                signature, changes[table] = _table_signature(connection, table, columns,
+                                                             saved and saved["signature"])
+                tables[table] = {"columns": columns, "signature": signature}
+            for name, spec in insight_rollups.items():
+                state[name] = _refresh_rollup(connection, name, spec, state.get(name), changes,
+                                              {table: entry["signature"] for table, entry in tables.items()})
+        state["tables"] = tables
+        state["file_version"] = file_version
+        _write_atomic(_state_file, lambda tmp: _dump_state(state, tmp))
+
+# Keyed by the database version: while the data is unchanged, every rerun gets the same objects back
+@st.cache_resource(show_spinner="Refreshing data insights...", max_entries=2)
+def get_insights(db_version):
+    """DataFrames ready to plot for the "Data Insights" section of the dashboard."""
+    refresh_insights()
+    top_artists = pd.read_parquet(_rollup_path("top_artists"))
+    genre_distribution = pd.read_parquet(_rollup_path("genre_distribution"))
+    sales_over_time = pd.read_parquet(_rollup_path("sales_over_time"))
+    return {
+        "top_artists": top_artists.nlargest(10, "TrackCount")[["Name", "TrackCount"]],
+        "genre_distribution": genre_distribution.nlargest(10, "TrackCount")[["Name", "TrackCount"]],
+        "sales_over_time": sales_over_time.sort_values("Month")[["Month", "TotalSales"]],
+    }
@@ -0,0 +1,56 @@
+# utils/metrics_st.py
+# append-only store for the metadata of each chatbot answer
+
+# columns of the chat metadata, in the order they are logged
+metadata_columns = (
+    'timestamp',
+    'message_index',
+    'provider',
+    'model',
+    'user_prompt',
+    'elapsed_time',
+    'time_to_first_token',
+    'tokens_per_second',
+    'total_messages',
+    'prompt_tokens',
+    'completion_tokens',
+    'total_tokens',
+    'cached_tokens',  # prompt tokens served from the provider's prompt cache, empty if not reported
+    'token_source',
+)
+
+
+class ChatMetricsRecord:
+    __slots__ = metadata_columns
+
+    def __init__(self, **values):
+        for column in metadata_columns:
+            setattr(self, column, values.get(column))
+
+    def as_dict(self):
+        return {column: getattr(self, column) for column in metadata_columns}
+
+
+class ChatMetrics:
+    """Per-answer metadata of a chat session.
+
+    Appending and looking up the record of a message are O(1).
+    """
+
+    def __init__(self):
+        self._records = []
+        self._by_message_index = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def append(self, **values):
+        record = ChatMetricsRecord(**values)
+        self._records.append(record)
+        # a cleared chat reuses message indexes, the newest record wins
+        self._by_message_index[record.message_index] = record
+        return record
+
+    def get(self, message_index):
+        """The record of the assistant message at message_index, or None."""
+        return self._by_message_index.get(message_index)
@@ -0,0 +1,204 @@
+# utils/query_history_st.py
+# memory-bounded store for st.session_state.query_history, shared by the database and chart pages
+
+import os
+import time
+import uuid
+import weakref
+import threading
+import streamlit as st
+import pandas as pd
+from utils.settings_st import query_history_session_bytes, query_history_global_bytes
+from utils.boot_st import get_db
+from utils.query_st import execute_cached_sql_query, get_spill_root, SpillPath, write_result_parquet, read_result_parquet
+
+
+class QueryHistoryEntry:
+    __slots__ = ("query", "result", "error", "summary", "evicted_path", "nbytes", "last_access")
+
+    def __init__(self, query):
+        self.query = query
+        self.result = None        # DataFrame while the entry is loaded
+        self.error = None         # error message (as stored by the page) if the query failed
+        self.summary = None       # shape, dtypes and head, kept when the result is evicted
+        self.evicted_path = None  # Parquet copy of an evicted result, deleted with the entry
+        self.nbytes = 0
+        self.last_access = time.monotonic()
+
+    @property
+    def is_loaded(self):
+        return self.result is not None
+
+
+class _HistoryRegistry:
+    """Every live QueryHistory of this process, so the global budget can be enforced."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.stores = weakref.WeakSet()
+
+    def enforce_budget(self):
+        with self.lock:
+            stores = list(self.stores)
+            total = sum(store.nbytes for store in stores)
+            while total > query_history_global_bytes:
+                candidates = [(entry.last_access, store, entry) for store in stores
+                              for entry in store._entries.values() if entry.is_loaded]
+                if not candidates:
+                    break
+                _, store, entry = min(candidates, key=lambda candidate: candidate[0])
+                total -= store._evict(entry)
+
+@st.cache_resource(show_spinner=False)
+def _get_registry():
+    return _HistoryRegistry()
+
+def _rerun_query(query):
+    engine, _ = get_db()
+    return execute_cached_sql_query(query, engine)
+
+
+class QueryHistory:
+    """Query text -> result mapping with a memory budget.
+
+    Results are evicted least recently used first once the session or global budget is
+    exceeded. An evicted entry keeps a compact summary and is reloaded on access, from its
+    Parquet copy on disk or, if that is gone, by running the query again.
+    """
+
+    def __init__(self, executor=_rerun_query, budget_bytes=query_history_session_bytes):
+        self._entries = {}  # insertion order is the display order
+        self._executor = executor
+        self._budget_bytes = budget_bytes
+        self._registry = _get_registry()
+        with self._registry.lock:
+            self._registry.stores.add(self)
+
+    @property
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, query):
+        return query in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def items(self):
+        """(query, QueryHistoryEntry) pairs in insertion order, without reloading anything."""
+        return list(self._entries.items())
+
+    def loaded_result(self, query):
+        """The query's DataFrame if it is in memory, counting as an access; None if it was evicted."""
+        with self._registry.lock:
+            entry = self._entries[query]
+            if entry.is_loaded:
+                entry.last_access = time.monotonic()
+            return entry.result
+
+    def __setitem__(self, query, result):
+        with self._registry.lock:
+            old_entry = self._entries.get(query)
+            if old_entry is not None:
+                self._discard(old_entry)  # the new entry keeps the old one's position
+            entry = QueryHistoryEntry(query)
+            if isinstance(result, pd.DataFrame):
+                self._load(entry, result)
+            else:
+                entry.error = result
+            self._entries[query] = entry
+            self._enforce_budget()
+
+    def __getitem__(self, query):
+        """The query's DataFrame (reloaded if it was evicted) or its error message."""
+        with self._registry.lock:
+            entry = self._entries[query]
+            entry.last_access = time.monotonic()
+            if entry.error is not None:
+                return entry.error
+            if entry.is_loaded:
+                return entry.result
+        result = self._reload(entry)
+        with self._registry.lock:
+            if not isinstance(result, pd.DataFrame):
+                entry.error = f"Error: {result}"
+                return entry.error
+            self._load(entry, result)
+            self._enforce_budget()
+            return result
+
+    def clear(self):
+        with self._registry.lock:
+            for entry in self._entries.values():
+                self._discard(entry)
+            self._entries.clear()
+
+    def _load(self, entry, df):
+        entry.result = df
+        entry.nbytes = int(df.memory_usage(deep=True).sum())
+        entry.summary = {
+            "shape": (df.attrs.get("total_rows", len(df)), df.shape[1]),
+            "columns": df.columns,
+            "dtypes": df.dtypes.astype(str).to_dict(),
+            "head": df.head(5),
+        }
+        entry.last_access = time.monotonic()
+
+    def _reload(self, entry):
+        if entry.evicted_path and os.path.exists(entry.evicted_path):
+            df = read_result_parquet(entry.evicted_path, entry.summary["columns"])
+            df.attrs = entry.summary.get("attrs", {})
+            return df
+        return self._executor(entry.query)
+
+    def _evict(self, entry):
+        """Drop an entry's DataFrame from memory, returns the number of bytes freed."""
+        if entry.evicted_path is None:
+            try:
+                path = os.path.join(get_spill_root(), f"history_{uuid.uuid4().hex}.parquet")
+                write_result_parquet(entry.result, path)
+                entry.evicted_path = SpillPath(path)
+            except Exception:
+                entry.evicted_path = None  # reloading will run the query again
+        entry.summary["attrs"] = dict(entry.result.attrs)
+        freed = entry.nbytes
+        entry.result = None
+        entry.nbytes = 0
+        return freed
+
+    def _discard(self, entry):
+        if entry.evicted_path is not None:
+            entry.evicted_path.remove()
+
+    def _enforce_budget(self):
+        while self.nbytes > self._budget_bytes:
+            loaded = [entry for entry in self._entries.values() if entry.is_loaded]
+            if len(loaded) <= 1:
+                break  # always keep the most recent result in memory
+            self._evict(min(loaded, key=lambda entry: entry.last_access))
+        self._registry.enforce_budget()
+
+def init_query_history():
+    """Create st.session_state.query_history for this session if needed."""
+    if not isinstance(st.session_state.get("query_history"), QueryHistory):
+        st.session_state.query_history = QueryHistory()
+    return st.session_state.query_history
+
+def render_evicted_entry(query, entry, key):
+    """Show the summary of an evicted result, with a button to load it back.
+
+    Returns the reloaded DataFrame, or None while the result stays on disk.
+    """
+    rows, columns = entry.summary["shape"]
+    st.info(f"Result of {rows} rows x {columns} columns was moved out of memory. Showing the first rows.")
+    st.dataframe(entry.summary["head"])
+    st.caption(", ".join(f"{column}: {dtype}" for column, dtype in entry.summary["dtypes"].items()))
+    if st.button("Load full result", key=key):
+        result = st.session_state.query_history[query]
+        if isinstance(result, pd.DataFrame):
+            return result
+        st.error(result)
+    return None
@@ -0,0 +1,264 @@
+# utils/query_plan_st.py
+# EXPLAIN QUERY PLAN inspector and index advisor for the Database Assistant
+
+import os
+import re
+import sqlite3
+import statistics
+from collections import OrderedDict
+import streamlit as st
+import pandas as pd
+from sqlalchemy import text
+from utils.boot_st import get_db, create_db_engine
+from utils.query_st import execute_sql_query, validate_read_only, normalize_sql
+from utils.settings_st import (path_to_db_file, index_advisor_copy_path, index_advisor_allow_create,
+                               index_advisor_max_columns)
+
+# FROM/JOIN <table> [AS] <alias>, to map the aliases shown in query plans back to tables
+_table_reference = re.compile(r"\b(?:from|join)\s+[`\"\[]?(\w+)[`\"\]]?(?:\s+(?:as\s+)?(\w+))?", re.I)
+# the rest of a comma separated FROM list: FROM a x, b y WHERE ...
+_from_list = re.compile(r"\bfrom\s+([^()]*?)(?=\b(?:where|join|inner|left|right|full|cross|natural|group|order|limit|"
+                        r"having|window|union|except|intersect)\b|[();]|$)", re.I | re.S)
+_list_item = re.compile(r"\s*[`\"\[]?(\w+)[`\"\]]?(?:\s+(?:as\s+)?(\w+))?\s*$", re.I)
+_not_aliases = {"where", "join", "on", "inner", "left", "right", "full", "cross", "outer", "natural",
+                "group", "order", "limit", "using", "union", "having", "window", "except", "intersect"}
+_clause_end = re.compile(r"\b(?:group|order|limit|having|window|union|except|intersect)\b", re.I)
+
+def explain_query(query, engine):
+    """The EXPLAIN QUERY PLAN rows of a read-only query as a DataFrame (id, parent, detail), or an error message."""
+    error = validate_read_only(query)
+    if error is not None:
+        return error
+    try:
+        with engine.connect() as connection:
+            rows = connection.execute(text(f"EXPLAIN QUERY PLAN {query.strip().rstrip(';')}")).fetchall()
+    except Exception as e:
+        return str(e)
+    return pd.DataFrame([(row[0], row[1], row[3]) for row in rows], columns=["id", "parent", "detail"])
+
+def format_plan(plan):
+    """The plan as an indented tree, the way the sqlite3 shell prints it."""
+    depth = {0: -1}
+    lines = []
+    for row in plan.itertuples():
+        depth[row.id] = depth.get(row.parent, -1) + 1
+        lines.append("  " * depth[row.id] + row.detail)
+    return "\n".join(lines)
+
+def table_aliases(query, metadata):
+    """{name or alias (lower case): table name} for the tables the query reads."""
+    tables = {name.lower(): name for name in metadata.tables}
+    references = [match.groups() for match in _table_reference.finditer(query)]
+    for from_list in _from_list.finditer(query):
+        items = [_list_item.match(item) for item in from_list.group(1).split(",")[1:]]
+        references += [item.groups() for item in items if item]
+    aliases = {}
+    for name, alias in references:
+        table = tables.get(name.lower())
+        if table is None:
+            continue
+        aliases[table.lower()] = table
+        if alias and alias.lower() not in _not_aliases:
+            aliases[alias.lower()] = table
+    return aliases
+
+def plan_findings(plan, aliases):
+    """Steps of the plan worth a look: full table scans, temporary B-trees and automatic indexes."""
+    findings = []
+    for detail in plan["detail"]:
+        scan = re.match(r"SCAN (\w+)(.*)", detail)
+        automatic = re.match(r"SEARCH (\w+) USING AUTOMATIC (?:COVERING )?INDEX \((.*)\)", detail)
+        if scan and "COVERING INDEX" not in scan.group(2) and scan.group(1).lower() in aliases:
+            findings.append({"kind": "full scan", "table": aliases[scan.group(1).lower()], "detail": detail})
+        elif automatic and automatic.group(1).lower() in aliases:
+            columns = tuple(re.findall(r"(\w+)\s*[=<>]", automatic.group(2)))
+            findings.append({"kind": "automatic index", "table": aliases[automatic.group(1).lower()],
+                             "columns": columns, "detail": detail})
+        elif detail.startswith("USE TEMP B-TREE"):
+            findings.append({"kind": "temp b-tree", "table": None, "detail": detail})
+    return findings
+
+def _rowid_columns(table):
+    """Lower case names of the rowid and its INTEGER PRIMARY KEY alias, stored in every index of the table."""
+    primary_key = list(table.primary_key.columns)
+    names = {"rowid"}
+    if len(primary_key) == 1 and str(primary_key[0].type).upper() == "INTEGER":
+        names.add(primary_key[0].name.lower())
+    return names
+
+def _is_indexed(table, columns):
+    """Whether an existing index (or the primary key) starts with these columns.
+
+    An index leading with the primary key's first column is never suggested: the key's own
+    index (or, for an INTEGER PRIMARY KEY, the rowid) already finds the rows.
+    """
+    columns = [column.lower() for column in columns]
+    primary_key = [column.name.lower() for column in table.primary_key.columns]
+    if columns[0] == "rowid" or primary_key[:1] == columns[:1]:
+        return True
+    return any([column.name.lower() for column in index.columns][:len(columns)] == columns for index in table.indexes)
+
+def _index_statement(table, columns):
+    name = f"idx_{table}_{'_'.join(columns)}"
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    return f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_list});'
+
+def suggest_indexes(query, findings, aliases, metadata, max_columns=index_advisor_max_columns):
+    """Indexes that could help the query, as a list of {table, columns, reason, sql}.
+
+    - foreign keys joining two tables of the query, when their column has no index;
+    - the columns SQLite builds an automatic index on, every time the query runs;
+    - for tables read by a full scan: the filtered columns, widened to a covering index
+      of every column the query uses from that table when that stays small.
+    Column use is read from the words of the query, so it is a heuristic, not a parse.
+    """
+    words = set(re.findall(r"\w+", normalize_sql(query)))
+    where = re.search(r"\bwhere\b(.*)", normalize_sql(query), re.S)
+    where_words = set(re.findall(r"\w+", _clause_end.split(where.group(1))[0])) if where else set()
+    query_tables = set(aliases.values())
+    suggestions = OrderedDict()
+
+    def suggest(table_name, columns, reason):
+        table = metadata.tables[table_name]
+        # the rowid is in every index already, an index only needs it to lead
+        columns = columns[:1] + [name for name in columns[1:] if name.lower() not in _rowid_columns(table)]
+        key = (table_name, tuple(columns))
+        if columns and key not in suggestions and not _is_indexed(table, columns):
+            suggestions[key] = {"table": table_name, "columns": list(columns), "reason": reason,
+                                "sql": _index_statement(table_name, columns)}
+
+    # join paths: an unindexed foreign key makes the join scan the child table
+    for table_name in sorted(query_tables):
+        for fk in metadata.tables[table_name].foreign_keys:
+            parent = fk.column.table.name
+            if parent in query_tables and fk.parent.name.lower() in words:
+                suggest(table_name, [fk.parent.name], f"foreign key to {parent}, used to join {table_name} and {parent}")
+
+    for finding in findings:
+        if finding["kind"] == "automatic index":
+            suggest(finding["table"], list(finding["columns"]), "SQLite builds this index as a temporary index on every run")
+        elif finding["kind"] == "full scan":
+            table = metadata.tables[finding["table"]]
+            # the primary key already searches its own columns, and every index stores the rowid
+            rowid_columns = _rowid_columns(table)
+            key_columns = rowid_columns | {column.name.lower() for column in list(table.primary_key.columns)[:1]}
+            indexable = [column.name for column in table.columns if column.name.lower() not in rowid_columns]
+            used = [name for name in indexable if name.lower() in words]
+            filtered = [name for name in used if name.lower() in where_words and name.lower() not in key_columns]
+            # join and filter columns lead, so the index can also be searched
+            join_columns = [fk.parent.name for fk in table.foreign_keys if fk.parent.name in used and fk.parent.name not in filtered]
+            covering = filtered + join_columns + [name for name in used if name not in filtered and name not in join_columns]
+            if filtered and len(covering) <= max_columns:
+                suggest(table.name, covering, f"covering index for the filter on {', '.join(filtered)}, instead of a full scan")
+            elif filtered:
+                suggest(table.name, filtered, f"filter on {', '.join(filtered)}, instead of a full scan")
+            elif used and len(covering) <= max_columns and len(covering) < len(indexable):
+                suggest(table.name, covering, "covering index: the scan reads a narrow index instead of the whole table")
+    return list(suggestions.values())
+
+
+def record_timing(query, elapsed_time):
+    """Keep the execution time of a query (not served from a cache) for this session."""
+    timings = st.session_state.setdefault("query_timings", {})
+    timings.setdefault(normalize_sql(query), []).append(elapsed_time)
+
+def describe_timings(query):
+    timings = st.session_state.get("query_timings", {}).get(normalize_sql(query), [])
+    if not timings:
+        return "Execution time: not timed yet"
+    return (f"Execution time over {len(timings)} run(s): last {timings[-1]:.3f} s, best {min(timings):.3f} s, "
+            f"median {statistics.median(timings):.3f} s")
+
+def time_query(query, engine):
+    """Run the query without the result cache, returns its execution time or an error message."""
+    response = execute_sql_query(query, engine)
+    if not isinstance(response, pd.DataFrame):
+        return response
+    return response.attrs["elapsed_time"]
+
+
+def create_indexes_on_copy(statements, path=index_advisor_copy_path):
+    """Run CREATE INDEX statements on a copy of the database (made on first use), never on the app's file.
+
+    Returns None, or the error message.
+    """
+    try:
+        if not os.path.exists(path):
+            source = sqlite3.connect(f"file:{path_to_db_file}?mode=ro", uri=True)
+            copy = sqlite3.connect(path)
+            try:
+                source.backup(copy)
+            finally:
+                source.close()
+                copy.close()
+        connection = sqlite3.connect(path)
+        try:
+            for statement in statements:
+                connection.execute(statement)
+            connection.commit()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        return str(e)
+    return None
+
+@st.cache_resource(show_spinner=False)
+def get_index_copy_engine():
+    return create_db_engine(index_advisor_copy_path)
+
+
+def render_query_inspector(query):
+    """Plan, findings, timings and index suggestions for query, in the Database Assistant."""
+    engine, metadata = get_db()
+    st.subheader("Query plan")
+    st.code(query, language="sql")
+    plan = explain_query(query, engine)
+    if not isinstance(plan, pd.DataFrame):
+        st.error(f"Error explaining query: {plan}")
+        return
+    st.code(format_plan(plan), language="text")
+
+    aliases = table_aliases(query, metadata)
+    findings = plan_findings(plan, aliases)
+    for finding in findings:
+        where = f" of {finding['table']}" if finding["table"] else ""
+        st.warning(f"{finding['kind'].capitalize()}{where}: {finding['detail']}")
+    if not findings:
+        st.success("No full table scans, temporary B-trees or automatic indexes.")
+
+    if st.button("Time query (without the result cache)"):
+        elapsed_time = time_query(query, engine)
+        if isinstance(elapsed_time, str):
+            st.error(f"Error executing query: {elapsed_time}")
+        else:
+            record_timing(query, elapsed_time)
+    st.caption(describe_timings(query))
+
+    suggestions = suggest_indexes(query, findings, aliases, metadata)
+    if not suggestions:
+        return
+    st.subheader("Suggested indexes")
+    for suggestion in suggestions:
+        st.markdown(f"- **{suggestion['table']}** ({', '.join(suggestion['columns'])}): {suggestion['reason']}")
+    statements = [suggestion["sql"] for suggestion in suggestions]
+    st.code("\n".join(statements), language="sql")
+    if not index_advisor_allow_create:
+        st.caption("Creating indexes is disabled: set index_advisor_allow_create in utils/settings_st.py "
+                   f"to try them on a copy of the database ({index_advisor_copy_path}).")
+        return
+    approved = st.checkbox(f"Create these indexes on the copy {index_advisor_copy_path}")
+    if st.button("Create indexes on the copy", disabled=not approved):
+        error = create_indexes_on_copy(statements)
+        if error is not None:
+            st.error(f"Error creating indexes: {error}")
+            return
+        copy_engine = get_index_copy_engine()
+        copy_plan = explain_query(query, copy_engine)
+        if isinstance(copy_plan, pd.DataFrame):
+            st.markdown("Plan on the copy:")
+            st.code(format_plan(copy_plan), language="text")
+        elapsed_time = time_query(query, copy_engine)
+        if isinstance(elapsed_time, str):
+            st.error(f"Error executing query on the copy: {elapsed_time}")
+        else:
+            st.caption(f"On the copy: {elapsed_time:.3f} s ({describe_timings(query)} on the app's database)")
@@ -0,0 +1,355 @@
+# utils/query_st.py
+# bounded, streaming execution of user-supplied SQL queries
+
+import os
+import re
+import hashlib
+import time
+import atexit
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+import streamlit as st
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import text
+from utils.settings_st import (query_chunk_rows, query_memory_rows, query_max_rows,
+                               query_max_bytes, query_timeout, query_spill_dir,
+                               query_cache_bytes, query_cache_max_entry_bytes)
+from utils.db_stats_st import get_db_version
+
+_spill_root = None
+
+def get_spill_root():
+    # one temporary folder per process, removed when the server stops
+    global _spill_root
+    if _spill_root is None:
+        _spill_root = tempfile.mkdtemp(prefix="chinook_results_", dir=query_spill_dir)
+        atexit.register(shutil.rmtree, _spill_root, True)
+    return _spill_root
+
+def _remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+class SpillPath(os.PathLike):
+    """A spill folder or file, deleted once no result (or history entry) refers to it any more.
+
+    It is kept in df.attrs, which pandas copies from frame to frame: copies share the same object,
+    so the files live as long as one of the frames, whether held by a session or the result cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._finalizer = weakref.finalize(self, _remove_path, path)
+
+    def remove(self):
+        self._finalizer()
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return repr(self.path)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+def _unique_columns(columns):
+    """Column names made unique for Parquet: a repeated TrackId becomes TrackId_1, TrackId_2..."""
+    seen = set(columns)
+    unique = []
+    counts = {}
+    for column in columns:
+        if column in unique:
+            counts[column] = counts.get(column, 0) + 1
+            while f"{column}_{counts[column]}" in seen:
+                counts[column] += 1
+            column = f"{column}_{counts[column]}"
+            seen.add(column)
+        unique.append(column)
+    return unique
+
+def write_result_parquet(df, path):
+    """Write a query result to Parquet, which needs unique column names of a single type each.
+
+    Duplicated names (JOINs of tables sharing a key) are renamed, read_result_parquet restores them.
+    df.attrs are not written, the caller keeps them.
+    """
+    df = df.copy(deep=False)
+    df.attrs = {}
+    if df.columns.has_duplicates:
+        df.columns = _unique_columns(list(df.columns))
+    try:
+        df.to_parquet(path, index=False)
+    except (pa.ArrowException, ValueError):
+        # SQLite columns can mix types from row to row, which Parquet can't store: keep them as text
+        df = df.copy()
+        for column in df.select_dtypes(include="object").columns:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+        df.to_parquet(path, index=False)
+
+def read_result_parquet(path, columns):
+    """Read a result written by write_result_parquet, with its original column names."""
+    df = pd.read_parquet(path)
+    df.columns = columns
+    return df
+
+def _write_spill_part(chunk, spill_path, part_number):
+    write_result_parquet(chunk, os.path.join(spill_path, f"part-{part_number:06d}.parquet"))
+
+def load_full_result(df):
+    """Return the complete result of a query, reading it back from its spill folder if needed."""
+    spill_path = df.attrs.get("spill_path")
+    if not spill_path or not os.path.isdir(spill_path):
+        return df
+    parts = sorted(os.listdir(spill_path))
+    full_df = pd.concat([read_result_parquet(os.path.join(spill_path, part), df.columns) for part in parts],
+                        ignore_index=True)
+    full_df.attrs = dict(df.attrs)
+    return full_df
+
+def describe_result(df):
+    """One line summary of a query result for the UI."""
+    attrs = df.attrs
+    message = f"{attrs.get('total_rows', len(df))} rows in {attrs.get('elapsed_time', 0):.2f} seconds"
+    if attrs.get("cache_hit"):
+        message += " (served from the result cache)"
+    if attrs.get("spill_path"):
+        message += f", showing the first {len(df)} (full result spilled to disk)"
+    if attrs.get("truncated"):
+        message += f". Result truncated at the {query_max_rows} rows / {query_max_bytes // (1024 * 1024)} MB limit"
+    return message
+
+def execute_sql_query(query, engine, on_first_chunk=None):
+    """Run a query in bounded chunks, returns a DataFrame or the error message as a string.
+
+    Fetching stops at query_max_rows / query_max_bytes, and the query is interrupted
+    after query_timeout seconds. Only the first query_memory_rows rows are kept in memory;
+    larger results are written chunk by chunk to a Parquet spill folder (see load_full_result).
+    on_first_chunk, if given, is called with the first chunk as soon as it arrives.
+    """
+    start_time = time.time()
+    deadline = start_time + query_timeout
+    try:
+        with engine.connect() as connection:
+            dbapi_connection = connection.connection.driver_connection
+            # SQLite calls the handler every 1000 VM instructions, a non-zero return interrupts the query
+            dbapi_connection.set_progress_handler(lambda: int(time.time() > deadline), 1000)
+            try:
+                result = connection.execution_options(stream_results=True).execute(text(query))
+                if not result.returns_rows:
+                    return pd.DataFrame()
+                columns = list(result.keys())
+
+                memory_chunks = []
+                memory_rows = 0
+                total_rows = 0
+                total_bytes = 0
+                truncated = False
+                spill_path = None
+                part_number = 0
+
+                while True:
+                    rows = result.fetchmany(query_chunk_rows)
+                    if not rows:
+                        break
+                    chunk = pd.DataFrame(rows, columns=columns)
+                    if total_rows + len(chunk) > query_max_rows:
+                        chunk = chunk.iloc[:query_max_rows - total_rows]
+                        truncated = True
+                    total_rows += len(chunk)
+                    total_bytes += int(chunk.memory_usage(deep=True).sum())
+
+                    if part_number == 0 and on_first_chunk is not None:
+                        on_first_chunk(chunk)
+
+                    if spill_path is None and memory_rows + len(chunk) > query_memory_rows:
+                        # the result no longer fits in memory: write everything seen so far to disk
+                        spill_path = SpillPath(tempfile.mkdtemp(prefix="query_", dir=get_spill_root()))
+                        for spill_number, memory_chunk in enumerate(memory_chunks):
+                            _write_spill_part(memory_chunk, spill_path, spill_number)
+                    if spill_path is not None:
+                        _write_spill_part(chunk, spill_path, part_number)
+                    if memory_rows < query_memory_rows:
+                        memory_chunks.append(chunk.iloc[:query_memory_rows - memory_rows])
+                        memory_rows += len(memory_chunks[-1])
+                    part_number += 1
+
+                    if truncated or total_bytes >= query_max_bytes:
+                        truncated = True
+                        break
+            finally:
+                dbapi_connection.set_progress_handler(None, 0)
+    except Exception as e:
+        if time.time() > deadline:
+            return f"Query interrupted after the {query_timeout} seconds time limit"
+        return str(e)
+
+    if memory_chunks:
+        df = pd.concat(memory_chunks, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=columns)
+    df.attrs = {
+        "total_rows": total_rows,
+        "truncated": truncated,
+        "elapsed_time": time.time() - start_time,
+        "spill_path": spill_path,
+    }
+    df.attrs.update(describe_columns(df))
+    return df
+
+def describe_columns(df):
+    """Fingerprint and column types of a result, computed once when the query runs and kept in df.attrs."""
+    digest = hashlib.sha256()
+    digest.update(repr(list(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    # a spilled result is identified by its folder, the rows on disk are not hashed
+    digest.update(repr((df.attrs.get("total_rows"), df.attrs.get("spill_path"))).encode())
+    return {
+        "fingerprint": digest.hexdigest(),
+        "numeric_columns": df.select_dtypes(include=['int64', 'float64']).columns.tolist(),
+    }
+
+def result_fingerprint(df):
+    return df.attrs.get("fingerprint") or describe_columns(df)["fingerprint"]
+
+def numeric_columns(df):
+    """Columns of a result usable as a chart's Y axis."""
+    if "numeric_columns" in df.attrs:
+        return df.attrs["numeric_columns"]
+    return describe_columns(df)["numeric_columns"]
+
+
+_sql_token = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<literal>[xX]'[^']*'|'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<space>\s+)
+  | (?P<word>\w+)
+  | (?P<symbol>.)
+""", re.S | re.X)
+
+def normalize_sql(query):
+    """Canonical form of a query: no comments, collapsed whitespace, lowercase outside quotes."""
+    tokens = []
+    previous_kind = None
+    for match in _sql_token.finditer(query):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        token = match.group() if kind == "literal" else match.group().lower()
+        # a space is only needed to keep two words or literals apart: 'a' 'b' is not 'a''b'
+        if kind in ("word", "literal") and previous_kind in ("word", "literal"):
+            tokens.append(" ")
+        tokens.append(token)
+        previous_kind = kind
+    normalized = "".join(tokens)
+    return normalized.rstrip(";")
+
+# statements that may start a read-only query, and keywords that never appear in one
+_read_only_starts = {"select", "with", "values"}
+# (REPLACE is left out: it is also a string function, and REPLACE INTO can't start a read-only query)
+_write_keywords = {"insert", "update", "delete", "create", "drop", "alter",
+                   "attach", "detach", "pragma", "vacuum", "reindex", "analyze", "begin", "commit", "rollback"}
+
+def validate_read_only(query):
+    """None if query is a single read-only statement, otherwise the reason it was rejected.
+
+    Comments and quoted literals are skipped, so a keyword inside a string doesn't count.
+    """
+    statements = [[]]
+    for match in _sql_token.finditer(query):
+        if match.lastgroup == "word":
+            statements[-1].append(match.group().lower())
+        elif match.lastgroup == "symbol" and match.group() == ";":
+            statements.append([])
+    statements = [words for words in statements if words]
+    if not statements:
+        return "No SQL statement found"
+    if len(statements) > 1:
+        return "Only a single statement can be executed"
+    words = statements[0]
+    if words[0] not in _read_only_starts:
+        return f"Only read-only queries can be executed, not {words[0].upper()}"
+    written = _write_keywords.intersection(words)
+    if written:
+        return f"Only read-only queries can be executed, found {', '.join(sorted(written)).upper()}"
+    return None
+
+
+class ResultCache:
+    """Process-wide LRU cache of query results, bounded by their memory size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (DataFrame, nbytes)
+        self._db_version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, db_version):
+        # any change to the database file invalidates every cached result
+        if db_version != self._db_version:
+            self._entries.clear()
+            self.nbytes = 0
+            self._db_version = db_version
+
+    def get(self, key, db_version):
+        with self._lock:
+            self._check_version(db_version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, db_version, df):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > min(query_cache_max_entry_bytes, self.max_bytes):
+            return
+        with self._lock:
+            self._check_version(db_version)
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (df, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_bytes
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.nbytes, "hits": self.hits, "misses": self.misses}
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return ResultCache(query_cache_bytes)
+
+def execute_cached_sql_query(query, engine, on_first_chunk=None):
+    """execute_sql_query behind the process-wide result cache, shared by all sessions.
+
+    Queries are matched on their normalized text and the current database version.
+    """
+    cache = get_result_cache()
+    key = normalize_sql(query)
+    db_version = get_db_version()
+    cached = cache.get(key, db_version)
+    if cached is not None:
+        # a shallow copy, so the cache hit flag doesn't leak into the cached frame
+        df = cached.copy(deep=False)
+        df.attrs = {**cached.attrs, "cache_hit": True}
+        return df
+    response = execute_sql_query(query, engine, on_first_chunk=on_first_chunk)
+    if isinstance(response, pd.DataFrame):
+        cache.put(key, db_version, response)
+    return response
@@ -0,0 +1,177 @@
+# utils/response_cache_st.py
+# cache of chatbot answers, so repeated questions don't pay a full LLM round trip
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import urllib.request
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+from utils.settings_st import (response_cache_dir, response_cache_max_entries, response_cache_ttl,
+                               response_cache_embed_model, response_cache_similarity, ollama_base_url)
+
+def normalize_prompt(prompt):
+    """Lower case, single spaces and no trailing punctuation, so trivially different questions match."""
+    return re.sub(r"\s+", " ", prompt).strip().lower().rstrip("?!. ")
+
+def preamble_hash(messages):
+    """Fingerprint of the messages an answer was generated with: system prompt, examples and earlier turns."""
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(f"{message.role.value}\0{message.content}\0".encode())
+    return digest.hexdigest()
+
+def _entry_key(model, prompt, preamble):
+    return hashlib.sha256(f"{model}\0{preamble}\0{normalize_prompt(prompt)}".encode()).hexdigest()
+
+def embed_text(text):
+    """Normalized embedding of text from the Ollama embedding model, or None if it can't be computed."""
+    request = urllib.request.Request(
+        f"{ollama_base_url}/api/embed",
+        data=json.dumps({"model": response_cache_embed_model, "input": text}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            vector = np.asarray(json.load(response)["embeddings"][0], dtype=np.float32)
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else None
+
+
+class ResponseCache:
+    """LRU cache of answers with a time to live, persisted to a folder.
+
+    The exact tier matches (model, normalized question, preamble hash), where the preamble
+    includes the earlier turns of the conversation. If an embedding
+    model is configured, a question that misses it is compared with the cached questions
+    of the same model and preamble (brute force cosine similarity over a NumPy matrix),
+    and the closest one counts as a hit above the similarity threshold.
+    """
+
+    def __init__(self, path=response_cache_dir, max_entries=response_cache_max_entries,
+                 ttl=response_cache_ttl, embed_model=response_cache_embed_model,
+                 similarity=response_cache_similarity):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed_model = embed_model
+        self.similarity = similarity
+        self._entries = OrderedDict()  # key -> {model, preamble, prompt, answer, created}
+        self._vectors = {}             # key -> normalized embedding of the question
+        self._matrix = None            # (keys, stacked vectors), rebuilt after a change
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, entry):
+        return time.time() - entry["created"] > self.ttl
+
+    def _remove(self, key):
+        del self._entries[key]
+        if self._vectors.pop(key, None) is not None:
+            self._matrix = None
+
+    def lookup(self, model, prompt, preamble):
+        """(answer, similarity) of a cached answer to prompt, or None. Exact matches have similarity 1.0."""
+        key = _entry_key(model, prompt, preamble)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry):
+                    self._entries.move_to_end(key)
+                    return entry["answer"], 1.0
+                self._remove(key)
+            if not self.embed_model or not self._vectors:
+                return None
+        vector = embed_text(normalize_prompt(prompt))  # outside the lock, it's a network call
+        if vector is None:
+            return None
+        with self._lock:
+            if self._matrix is None:
+                keys = list(self._vectors)
+                self._matrix = (keys, np.stack([self._vectors[k] for k in keys]))
+            keys, matrix = self._matrix
+            if matrix.shape[1] != vector.shape[0]:
+                return None  # vectors of another embedding model
+            scores = matrix @ vector
+            for index in np.argsort(scores)[::-1]:
+                if scores[index] < self.similarity:
+                    break
+                entry = self._entries.get(keys[index])
+                if entry is None or entry["model"] != model or entry["preamble"] != preamble or self._expired(entry):
+                    continue
+                self._entries.move_to_end(keys[index])
+                return entry["answer"], float(scores[index])
+        return None
+
+    def put(self, model, prompt, preamble, answer):
+        key = _entry_key(model, prompt, preamble)
+        vector = embed_text(normalize_prompt(prompt)) if self.embed_model else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "model": model, "preamble": preamble, "prompt": prompt, "answer": answer, "created": time.time(),
+            }
+            if vector is not None:
+                self._vectors[key] = vector
+                self._matrix = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrix = None
+            self._save()
+
+    def _files(self):
+        return os.path.join(self.path, "responses.json"), os.path.join(self.path, "embeddings.npz")
+
+    def _load(self):
+        if not self.path:
+            return
+        entries_file, vectors_file = self._files()
+        try:
+            with open(entries_file) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, entry in state.get("entries", []):
+            if not self._expired(entry):
+                self._entries[key] = entry
+        if self.embed_model and state.get("embed_model") == self.embed_model:
+            try:
+                with np.load(vectors_file) as vectors:
+                    self._vectors = {key: vectors[key] for key in vectors.files if key in self._entries}
+            except (FileNotFoundError, ValueError, OSError):
+                pass
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        entries_file, vectors_file = self._files()
+        state = {"embed_model": self.embed_model, "entries": list(self._entries.items())}
+        with open(f"{entries_file}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{entries_file}.tmp", entries_file)
+        if self.embed_model:
+            with open(f"{vectors_file}.tmp", "wb") as f:
+                np.savez(f, **self._vectors)
+            os.replace(f"{vectors_file}.tmp", vectors_file)
+
+# one cache per server, shared by every session of the chatbot
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    return ResponseCache()
@@ -0,0 +1,154 @@
+# utils/schema_retriever_st.py
+# builds the chatbot's system prompt from the parts of the schema relevant to each question
+
+import re
+import math
+from collections import Counter, deque
+import streamlit as st
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from utils.boot_st import get_db
+from utils.settings_st import (chinook_schema_header, chinook_instructions, chinook_examples,
+                               schema_table_descriptions, schema_retriever_tables, schema_retriever_examples)
+
+# words that say nothing about which tables a question is about
+stop_words = frozenset("""
+    a an and are as at be by for from how in is it list me many much of on or show such than that the their
+    them these this those to what when where which who whom with each all any give find get
+""".split())
+
+def tokenize(text):
+    """Lower case words of text, with CamelCase and snake_case names split and plurals folded."""
+    words = [word.lower() for word in re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+", text or "")]
+    return [word[:-1] if len(word) > 3 and word.endswith("s") else word for word in words if word not in stop_words]
+
+
+class BM25:
+    """Okapi BM25 ranking over a small list of documents, kept in memory."""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    def scores(self, query):
+        terms = set(tokenize(query))
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            for term in terms:
+                tf = counts.get(term, 0)
+                if tf:
+                    norm = self.k1 * (1 - self.b + self.b * length / self.average_length)
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+
+def _describe_table(table):
+    """The table in the format of chinook_schema: columns, primary key and foreign keys."""
+    primary_key = [column.name for column in table.primary_key.columns]
+    lines = []
+    for column in table.columns:
+        line = f"{column.name} {column.type}"
+        if primary_key == [column.name]:
+            line += " PRIMARY KEY"
+        elif not column.nullable:
+            line += " NOT NULL"
+        lines.append(line)
+    if len(primary_key) > 1:
+        lines.append(f"PRIMARY KEY ({', '.join(primary_key)})")
+    for fk in sorted(table.foreign_keys, key=lambda fk: fk.parent.name):
+        lines.append(f"FOREIGN KEY ({fk.parent.name}) REFERENCES {fk.column.table.name}({fk.column.name})")
+    body = ", \n        ".join(lines)
+    return f"    '{table.name}': \n        '{body}'"
+
+
+class SchemaRetriever:
+    """Selects the tables and few-shot examples relevant to a question.
+
+    Tables are ranked with BM25 over their name (weighted up), column names and description.
+    The best ones are kept, plus the tables on the foreign key paths that join them,
+    so the model can still write the JOINs.
+    """
+
+    def __init__(self, metadata, examples=chinook_examples, descriptions=schema_table_descriptions):
+        self.tables = [metadata.tables[name] for name in sorted(metadata.tables)]
+        self.table_index = BM25([
+            " ".join([table.name] * 3 + [descriptions.get(table.name, "")] +
+                     [column.name for column in table.columns])
+            for table in self.tables
+        ])
+        self.descriptions = {table.name: _describe_table(table) for table in self.tables}
+        # foreign keys as an undirected graph, to find the join paths
+        self.neighbours = {table.name: set() for table in self.tables}
+        for table in self.tables:
+            for fk in table.foreign_keys:
+                other = fk.column.table.name
+                if other != table.name and other in self.neighbours:
+                    self.neighbours[table.name].add(other)
+                    self.neighbours[other].add(table.name)
+        self.examples = examples
+        self.example_index = BM25([question + " " + answer for question, answer in examples])
+
+    def _join_path(self, source, target):
+        """Tables on the shortest foreign key path from source to target, or [] if they aren't connected."""
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            name = queue.popleft()
+            if name == target:
+                path = []
+                while name is not None:
+                    path.append(name)
+                    name = previous[name]
+                return path[::-1]
+            for neighbour in sorted(self.neighbours[name]):
+                if neighbour not in previous:
+                    previous[neighbour] = name
+                    queue.append(neighbour)
+        return []
+
+    def relevant_tables(self, question, top_k=schema_retriever_tables, min_relative_score=0.3):
+        """Names of the tables to describe for question; all of them if nothing matches.
+
+        Tables scoring below min_relative_score times the best score are left out.
+        """
+        scores = self.table_index.scores(question)
+        cutoff = max(scores, default=0.0) * min_relative_score
+        ranked = sorted((score, table.name) for score, table in zip(scores, self.tables) if score > 0 and score >= cutoff)
+        best = [name for _, name in reversed(ranked)][:top_k]
+        if not best:
+            return [table.name for table in self.tables]
+        selected = dict.fromkeys(best)
+        for name in best[1:]:
+            selected.update(dict.fromkeys(self._join_path(best[0], name)))
+        return [table.name for table in self.tables if table.name in selected]
+
+    def relevant_examples(self, question, top_k=schema_retriever_examples):
+        scores = self.example_index.scores(question)
+        ranked = sorted(range(len(self.examples)), key=lambda i: scores[i], reverse=True)[:top_k]
+        return [self.examples[i] for i in sorted(ranked)]  # keep the original order of the examples
+
+    def system_prompt(self, question):
+        # the instructions come first: being the same for every question, they form a prefix
+        # that providers with prompt caching (and Ollama's loaded context) can reuse
+        schema = "\n".join(self.descriptions[name] for name in self.relevant_tables(question))
+        return f"{chinook_instructions}{chinook_schema_header}\n{schema}\n"
+
+    def build_preamble(self, question):
+        """System prompt and few-shot examples for question, to be used as the chat preamble."""
+        preamble = [ChatMessage(role=MessageRole.SYSTEM, content=self.system_prompt(question))]
+        for example_question, example_answer in self.relevant_examples(question):
+            preamble.append(ChatMessage(role=MessageRole.USER, content=example_question))
+            preamble.append(ChatMessage(role=MessageRole.ASSISTANT, content=example_answer))
+        return preamble
+
+@st.cache_resource(show_spinner=False)
+def get_schema_retriever():
+    _, metadata = get_db()
+    return SchemaRetriever(metadata)
@@ -3,8 +3,74 @@
 path_to_db_file = 'db/Chinook_Sqlite.sqlite'
 db_url = f'sqlite:///{path_to_db_file}'
 
+# SQLite engine tuning, applied by create_db_engine() in utils/boot_st.py
+db_read_only = True     # open the file with mode=ro and PRAGMA query_only, the app never writes to it
+db_immutable = False    # immutable=1 skips all file locking; only safe if nothing else ever writes the file
+db_journal_mode = None  # e.g. 'WAL' so readers never block on a writer; it rewrites the file's header, None leaves it as is
+db_pool_size = 8        # pooled connections kept open for concurrent Streamlit sessions
+db_max_overflow = 8     # extra connections allowed under burst load
+db_pool_timeout = 30    # seconds to wait for a free connection before failing
+db_pragmas = {          # applied to every new pooled connection
+    'mmap_size': 268435456,  # 256 MB of memory-mapped reads
+    'cache_size': -65536,    # 64 MB page cache (negative values are KiB)
+    'temp_store': 'MEMORY',  # sorts and temp B-trees stay in RAM
+}
+
+# Chat metadata log, written in batches by a background thread (see utils/telemetry_st.py)
+metadata_csv_path = 'log/metadata.csv'
+metadata_sqlite_path = 'log/metadata.sqlite'  # append-friendly copy of the log, None to only write the CSV
+telemetry_batch_size = 100       # rows written at most per batch
+telemetry_flush_interval = 1.0   # seconds the writer waits for more rows before flushing
+
+# Chat History Dashboard rollups (see utils/analytics_st.py)
+rollup_bucket_freq = 'D'         # time bucket of the aggregates: 'D' per day, 'h' per hour
+latency_sketch_accuracy = 0.01   # relative error of the response time quantiles
+
+# Schema statistics (row/column/FK/index counts) shown on the main dashboard
+# are cached for this many seconds, and dropped earlier if the database changes
+schema_stats_ttl = 600
+
+# The "Data Insights" rollups are materialized as Parquet files in this folder
+# and refreshed incrementally when their source tables change
+insights_cache_dir = 'cache/insights'
+
+# Limits for queries run from the Database Assistant (see execute_sql_query in utils/query_st.py)
+query_chunk_rows = 5000              # rows fetched from SQLite per chunk
+query_memory_rows = 10000            # rows kept in memory, larger results are spilled to Parquet on disk
+query_max_rows = 1000000             # stop fetching after this many rows
+query_max_bytes = 512 * 1024 * 1024  # ...or after this much data
+query_timeout = 30                   # seconds before a running query is interrupted
+query_spill_dir = None               # folder for spilled results, None uses the system temp folder
+query_cache_bytes = 256 * 1024 * 1024  # results shared between sessions by the process-wide result cache
+query_cache_max_entry_bytes = 64 * 1024 * 1024  # larger results are never cached
+
+# Memory budget for query results kept in st.session_state.query_history (see utils/query_history_st.py)
+# Least recently used results beyond the budget are moved to disk and reloaded on demand
+query_history_session_bytes = 256 * 1024 * 1024  # per session
+query_history_global_bytes = 1024 * 1024 * 1024  # across all sessions of this server
+
+# Explain mode of the Database Assistant (see utils/query_plan_st.py)
+# Suggested indexes are never created on the app's database, only on this copy, and only
+# once the operator has set index_advisor_allow_create = True
+index_advisor_copy_path = 'db/Chinook_Sqlite.indexed.sqlite'
+index_advisor_allow_create = False
+index_advisor_max_columns = 4   # widest covering index suggested
+
+# Query history view of the database and chart pages (see utils/history_view_st.py)
+history_page_size = 10       # queries listed per page, only the one opened shows its result
+history_rows_per_page = 100  # rows of a result sent to the browser at a time
+
+# Chart data reduction (see utils/chart_data_st.py), applied before a chart is sent to the browser
+chart_max_points = 5000     # points of a line or scatter chart, also Altair's default row limit
+chart_bar_top_n = 50        # bars kept, the remaining categories are summed as "Other"
+chart_webgl_points = 1000   # Plotly draws more points than this with WebGL
+figure_cache_entries = 128  # chart specs kept by the figure cache (see utils/figure_cache_st.py)
+
 # Define the Ollama connection parameters
 ollama_base_url = "http://localhost:11434"
+ollama_keep_alive = "30m"  # keep a model (and its cached prompt prefix) loaded between requests
+llm_warmup = True          # load the selected Ollama model in the background as soon as it is selected
+llm_warmup_ttl = 600       # seconds before the same model is warmed up again
 
 # Reminder: Ollama must be installed on the local PC!
 # Pull the models above with:
@@ -18,9 +84,51 @@ cohere_models = ["command-r-plus", "command-r", "command"]
 azure_openai_models = ["gpt-4o-mini"] # the name of the model is the name of the deployment
 openai_models = ["gpt-4o-mini"]
 
+# Context window (in tokens) of each model. The chat history sent to a model is trimmed
+# so that the prompt plus response_token_reserve always fits (see utils/chat_history_st.py)
+model_context_windows = {
+    "gemma2:2b-instruct-q8_0": 8192,
+    "gemma2:2b-instruct-fp16": 8192,
+    "gemma2:9b-instruct-q5_K_M": 8192,
+    "llama3.1:8b-instruct-q5_K_M": 8192,
+    "mixtral-8x7b-32768": 32768,
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "gemma2-9b-it": 8192,
+    "command-r-plus": 128000,
+    "command-r": 128000,
+    "command": 4096,
+    "gpt-4o-mini": 128000,
+}
+default_context_window = 4096  # for models missing above
+response_token_reserve = 1024  # tokens kept free for the answer
+chat_max_history_tokens = 6000 # cap on the history part of the prompt, even for large context windows
+chat_summary_tokens = 256      # room for the summary of turns that no longer fit (0 disables it)
+chat_preamble_length = 11      # system prompt + few-shot examples at the start of messages_chatbot
+chat_auto_execute_sql = True   # run the read-only SQL in chatbot answers and save the results to the query history
+
+# Dynamic schema context (see utils/schema_retriever_st.py): instead of the full schema and all examples,
+# each question gets the tables relevant to it, the tables joining them, and the closest examples
+chat_dynamic_schema = True
+prefix_cache_providers = ["OpenAI", "AzureOpenAI"]  # always get the full, identical preamble: it is served from their prompt cache
+schema_retriever_tables = 4    # most relevant tables kept, before adding the tables on their join paths
+schema_retriever_examples = 2  # few-shot examples (question + answer pairs) kept
+
+# Chatbot response cache (see utils/response_cache_st.py): a question asked again to the same model,
+# with the same system prompt, is answered from the cache instead of calling the LLM
+response_cache_dir = 'cache/responses'    # persisted here so the cache survives restarts, None keeps it in memory
+response_cache_max_entries = 1000         # least recently used answers are evicted beyond this
+response_cache_ttl = 7 * 24 * 3600        # seconds an answer stays valid
+response_cache_embed_model = None         # e.g. "nomic-embed-text" served by Ollama, enables matching similar questions
+response_cache_similarity = 0.92          # cosine similarity needed for a similar question to count as a hit
+
 # Azure OpenAI Configuration
 azure_openai_api_version = "2024-06-01"  # latest GA version
 
+# LLM clients are created on first use; provider availability (API key set, SDK installed,
+# Ollama server reachable) is probed at most once per this many seconds
+llm_probe_ttl = 60
+
 models = (
     [("Ollama", model) for model in ollama_models] +
     [("Groq", model) for model in groq_models] +
@@ -30,10 +138,14 @@ models = (
 )
 
 # This table_schema_dict represents the schema of the Chinook database as implemented in SQLite.
-chinook_system_prompt = """
+# The system prompt is made of a header, the schema of the tables and the instructions.
+# With chat_dynamic_schema the schema part is rebuilt for each question (see utils/schema_retriever_st.py)
+chinook_schema_header = """
 You are an expert on the Chinook database and SQLite.
 This is the SQLite database schema, with the list of the tables, respective columns, and foreign key relationships:
+"""
 
+chinook_schema = """
     'Album': 
         'AlbumId INTEGER PRIMARY KEY, 
         Title NVARCHAR(160) NOT NULL, 
@@ -131,7 +243,9 @@ This is the SQLite database schema, with the list of the tables, respective colu
         FOREIGN KEY (AlbumId) REFERENCES Album(AlbumId), 
         FOREIGN KEY (MediaTypeId) REFERENCES MediaType(MediaTypeId), 
         FOREIGN KEY (GenreId) REFERENCES Genre(GenreId)'
+"""
 
+chinook_instructions = """
 Your job is to answer data analysis questions about the Chinook database and to find ways of displaying data from the Chinook database using the pandas and plotly Python libraries. 
 Assume that all questions about database, tables, and columns are related to the Chinook database and to the SQLite SQL dialect.
 
@@ -154,6 +268,8 @@ Descriptive Analysis: Offer a concise descriptive analysis of the data, highligh
 Visualization Suggestions: Recommend the most appropriate types of visualization graphs to represent the data effectively. Explain why that type of graph is suitable based on the data structure.
 """
 
+chinook_system_prompt = chinook_schema_header + chinook_schema + chinook_instructions
+
 chinook_prompt_01 = """
 What's the total number of artists?
 """
@@ -250,4 +366,28 @@ A line chart or a time series plot would be suitable to visualize the total amou
 The x-axis should represent the invoice dates, and the y-axis should represent the total amounts. 
 This visualization will help identify trends in billing amounts over time. 
 Additionally, a bar chart could be used to compare total amounts billed across different customers.
-"""
\ No newline at end of file
+"""
+
+# Few-shot examples of the chatbot, as (question, answer) pairs
+chinook_examples = [
+    (chinook_prompt_01, chinook_reply_01),
+    (chinook_prompt_02, chinook_reply_02),
+    (chinook_prompt_03, chinook_reply_03),
+    (chinook_prompt_04, chinook_reply_04),
+    (chinook_prompt_05, chinook_reply_05),
+]
+
+# Words describing each table, indexed by the schema retriever along with the table and column names
+schema_table_descriptions = {
+    'Album': 'albums records released by artists',
+    'Artist': 'artists bands singers musicians performers',
+    'Customer': 'customers clients buyers people who purchased, their country city and support representative',
+    'Employee': 'employees staff sales support agents managers who reports to whom, hire date',
+    'Genre': 'genres music styles categories such as rock jazz metal',
+    'Invoice': 'invoices orders purchases sales revenue billing totals by date and country',
+    'InvoiceLine': 'invoice lines items sold quantity unit price, sales of tracks',
+    'MediaType': 'media types file formats such as MPEG AAC',
+    'Playlist': 'playlists collections of tracks',
+    'PlaylistTrack': 'tracks in each playlist',
+    'Track': 'tracks songs music duration milliseconds composer size bytes price',
+}
@@ -0,0 +1,57 @@
+# utils/sql_pipeline_st.py
+# runs the SQL the chatbot generates, so its results show up in the chat and in the query history
+
+import re
+import time
+import streamlit as st
+import pandas as pd
+from utils.boot_st import get_db
+from utils.query_st import execute_cached_sql_query, validate_read_only, describe_result
+from utils.query_history_st import init_query_history
+
+# the system prompt asks for every query in a ```sql fenced block
+_sql_block = re.compile(r"```sql[ \t]*\n(.*?)```", re.S | re.I)
+
+def extract_sql_blocks(text):
+    """The SQL queries in the ```sql blocks of an answer, in order."""
+    return [block.strip() for block in _sql_block.findall(text or "") if block.strip()]
+
+def run_generated_sql(response_text, generation_time):
+    """Validate, execute and show each SQL block of an answer, saving the results to the query history.
+
+    Returns the time spent in each stage (generate, parse, execute, render) for every executed query.
+    """
+    parse_start = time.time()
+    checked = [(query, validate_read_only(query)) for query in extract_sql_blocks(response_text)]
+    parse_time = time.time() - parse_start
+    if not checked:
+        return []
+
+    engine, _ = get_db()
+    history = init_query_history()
+    stage_times = []
+    for query, error in checked:
+        if error is not None:
+            st.warning(f"Generated SQL not executed: {error}")
+            continue
+
+        execute_start = time.time()
+        placeholder = st.empty()
+        response = execute_cached_sql_query(query, engine, on_first_chunk=placeholder.dataframe)
+        execute_time = time.time() - execute_start
+
+        render_start = time.time()
+        if isinstance(response, pd.DataFrame):
+            history[query] = response
+            placeholder.dataframe(response)
+            st.caption(describe_result(response))
+        else:
+            history[query] = f"Error: {response}"
+            placeholder.error(f"Error executing query: {response}")
+        render_time = time.time() - render_start
+
+        stage_times.append({"generate": generation_time, "parse": parse_time,
+                            "execute": execute_time, "render": render_time})
+        st.caption(f"Generate: {generation_time:.2f} s, parse: {parse_time * 1000:.1f} ms, "
+                   f"execute: {execute_time:.3f} s, render: {render_time:.3f} s. Saved to the query history.")
+    return stage_times
@@ -0,0 +1,128 @@
+# utils/telemetry_st.py
+# background writer for the chat metadata log, so logging never blocks a response
+
+import os
+import io
+import queue
+import atexit
+import sqlite3
+import threading
+from contextlib import contextmanager
+import streamlit as st
+import pandas as pd
+from utils.settings_st import (metadata_csv_path, metadata_sqlite_path,
+                               telemetry_batch_size, telemetry_flush_interval)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def log_lock(path, exclusive=True):
+    """Inter-process lock on a log file, held through a sidecar .lock file.
+
+    Writers take it exclusively; readers can take it shared to never see a half written batch.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def append_to_csv_log(df, csv_path):
+    """Append rows to a CSV log in a single write, widening its header once if columns were added."""
+    if os.path.exists(csv_path) and os.path.getsize(csv_path) > 0:
+        header = pd.read_csv(csv_path, nrows=0).columns.tolist()
+        if set(df.columns) - set(header):
+            # new columns were added to the log: migrate the file to the wider header
+            existing = pd.read_csv(csv_path)
+            tmp_path = f"{csv_path}.tmp"
+            pd.concat([existing, df], ignore_index=True).to_csv(tmp_path, index=False)
+            os.replace(tmp_path, csv_path)
+            return
+        df = df.reindex(columns=header)
+        write_header = False
+    else:
+        write_header = True
+    buffer = io.StringIO()
+    df.to_csv(buffer, header=write_header, index=False)
+    with open(csv_path, "a", newline="") as f:
+        f.write(buffer.getvalue())
+
+def append_to_sqlite_log(df, sqlite_path, table="metadata"):
+    """Append rows to a SQLite copy of the log, adding any new columns to the table."""
+    connection = sqlite3.connect(sqlite_path)
+    try:
+        existing = [row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')]
+        if existing:
+            for column in df.columns:
+                if column not in existing:
+                    connection.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}"')
+        df.to_sql(table, connection, if_exists="append", index=False)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class TelemetryWriter:
+    """Queue-fed thread that writes log rows in batches.
+
+    log() only enqueues the row. The thread waits up to telemetry_flush_interval for more rows,
+    then writes the batch to the CSV (and the optional SQLite copy) under the log lock.
+    """
+
+    def __init__(self, csv_path=metadata_csv_path, sqlite_path=metadata_sqlite_path):
+        self.csv_path = csv_path
+        self.sqlite_path = sqlite_path
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def log(self, row):
+        """Queue one row (a dict of column -> value) for writing."""
+        self._queue.put(row)
+
+    def flush(self):
+        """Block until every queued row has been written."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < telemetry_batch_size:
+                    batch.append(self._queue.get(timeout=telemetry_flush_interval))
+            except queue.Empty:
+                pass
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"Could not write {len(batch)} rows to the metadata log: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, rows):
+        df = pd.DataFrame(rows)
+        with log_lock(self.csv_path):
+            append_to_csv_log(df, self.csv_path)
+        if self.sqlite_path:
+            append_to_sqlite_log(df, self.sqlite_path)
+
+@st.cache_resource(show_spinner=False)
+def get_telemetry_writer():
+    return TelemetryWriter()
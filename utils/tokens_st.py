@@ -0,0 +1,111 @@
+# utils/tokens_st.py
+# token accounting: usage reported by the provider, or counted locally with a tokenizer
+
+from functools import lru_cache
+import tiktoken
+
+# Where each provider reports usage in the raw LlamaIndex response, as (prompt, completion) paths.
+# Raw responses are dicts for some providers and SDK objects for others, both are handled.
+provider_usage_paths = [
+    (("usage", "prompt_tokens"), ("usage", "completion_tokens")),                      # OpenAI, Azure OpenAI
+    (("x_groq", "usage", "prompt_tokens"), ("x_groq", "usage", "completion_tokens")),  # Groq streams
+    (("prompt_eval_count",), ("eval_count",)),                                         # Ollama
+    (("response", "meta", "billed_units", "input_tokens"),
+     ("response", "meta", "billed_units", "output_tokens")),                           # Cohere stream end
+    (("meta", "billed_units", "input_tokens"), ("meta", "billed_units", "output_tokens")),  # Cohere
+]
+
+# Where providers report prompt tokens served from their prompt cache
+provider_cached_paths = [
+    ("usage", "prompt_tokens_details", "cached_tokens"),  # OpenAI, Azure OpenAI
+    ("x_groq", "usage", "prompt_tokens_details", "cached_tokens"),  # Groq streams
+]
+
+# tokens added by the chat template around every message, and to prime the reply
+message_overhead_tokens = 4
+reply_overhead_tokens = 3
+
+def _encoding_name(model):
+    # OpenAI models use their own encodings; for Llama 3, Gemma, Mixtral and Command
+    # cl100k_base is a close approximation that needs no model download
+    if model.startswith(("gpt-4o", "o1", "o3")):
+        return "o200k_base"
+    return "cl100k_base"
+
+@lru_cache(maxsize=None)
+def _get_encoding(name):
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None  # e.g. the encoding file can't be downloaded: fall back to a character estimate
+
+@lru_cache(maxsize=8192)
+def _count_with_encoding(text, encoding_name):
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_tokens(text, model):
+    """Number of tokens in text for model, using a cached local tokenizer."""
+    return _count_with_encoding(text or "", _encoding_name(model))
+
+def count_message_tokens(message, model):
+    return count_tokens(message.content, model) + message_overhead_tokens
+
+def count_prompt_tokens(messages, model):
+    return sum(count_message_tokens(message, model) for message in messages) + reply_overhead_tokens
+
+def _lookup(obj, path):
+    for key in path:
+        if obj is None:
+            return None
+        obj = obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
+    return obj
+
+def provider_usage(response):
+    """(prompt_tokens, completion_tokens) reported by the provider, or None."""
+    if response is None:
+        return None
+    additional_kwargs = response.additional_kwargs or {}
+    if additional_kwargs.get("prompt_tokens") and additional_kwargs.get("completion_tokens") is not None:
+        return int(additional_kwargs["prompt_tokens"]), int(additional_kwargs["completion_tokens"])
+    for prompt_path, completion_path in provider_usage_paths:
+        prompt_tokens = _lookup(response.raw, prompt_path)
+        completion_tokens = _lookup(response.raw, completion_path)
+        if prompt_tokens is not None and completion_tokens is not None:
+            return int(prompt_tokens), int(completion_tokens)
+    return None
+
+def provider_cached_tokens(response):
+    """Prompt tokens the provider read from its prompt cache, or None if it doesn't say."""
+    if response is None:
+        return None
+    for path in provider_cached_paths:
+        cached_tokens = _lookup(response.raw, path)
+        if cached_tokens is not None:
+            return int(cached_tokens)
+    return None
+
+def token_usage(response, prompt_messages, response_text, model):
+    """Prompt, completion and total tokens of one request, and where the numbers come from.
+
+    response is the final (or last streamed) ChatResponse; provider-reported usage is preferred,
+    otherwise the full prompt that was sent and the answer are counted locally.
+    cached_tokens is only known when the provider reports it.
+    """
+    usage = provider_usage(response)
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage
+        source = "provider"
+    else:
+        prompt_tokens = count_prompt_tokens(prompt_messages, model)
+        completion_tokens = count_tokens(response_text, model)
+        source = "tokenizer"
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cached_tokens": provider_cached_tokens(response),
+        "token_source": source,
+    }